@@ -0,0 +1,57 @@
+import timeit
+import base64
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.Hash import SHA256
+from Crypto.Signature import pkcs1_15
+
+from key_loader import get_keys_by_index
+from encryption import rsa_encrypt
+from decryption import rsa_decrypt
+from digital_signature import generate_signature, verify_signature
+
+# Uncached equivalents of the four RSA hot-path functions: a new cipher/signer
+# object per call, as when they are handed a bare RsaKey.
+def rsa_encrypt_uncached(data, public_key):
+    return base64.b64encode(PKCS1_OAEP.new(public_key).encrypt(data.encode())).decode('utf-8')
+
+def rsa_decrypt_uncached(encrypted_data, private_key):
+    return PKCS1_OAEP.new(private_key).decrypt(base64.b64decode(encrypted_data)).decode()
+
+def generate_signature_uncached(data, private_key):
+    return base64.b64encode(pkcs1_15.new(private_key).sign(SHA256.new(data.encode()))).decode('utf-8')
+
+def verify_signature_uncached(data, signature, public_key):
+    try:
+        pkcs1_15.new(public_key).verify(SHA256.new(data.encode()), base64.b64decode(signature))
+        return True
+    except (ValueError, TypeError):
+        return False
+
+def bench(func, *args, number=200):
+    """Best per-call time in microseconds over a few repeats."""
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=5)) / number * 1e6
+
+def main():
+    keys = get_keys_by_index(0)
+    data = "17.385044,78.486671"
+    encrypted = rsa_encrypt(data, keys.public_rsa_oaep)
+    signature = generate_signature(data, keys.private_rsa_signer)
+
+    # (name, uncached function and its bare key, cached function and the PreparedKeys scheme, other args)
+    cases = [
+        ("rsa_encrypt", rsa_encrypt_uncached, keys.public_rsa, rsa_encrypt, keys.public_rsa_oaep, (data,)),
+        ("rsa_decrypt", rsa_decrypt_uncached, keys.private_rsa, rsa_decrypt, keys.private_rsa_oaep, (encrypted,)),
+        ("generate_signature", generate_signature_uncached, keys.private_rsa, generate_signature,
+         keys.private_rsa_signer, (data,)),
+        ("verify_signature", verify_signature_uncached, keys.public_rsa, verify_signature,
+         keys.public_rsa_verifier, (data, signature)),
+    ]
+
+    print(f"{'function':<20}{'uncached us':>14}{'cached us':>12}{'saved us':>11}")
+    for name, uncached, key, cached, scheme, args in cases:
+        before = bench(uncached, *args, key)
+        after = bench(cached, *args, scheme)
+        print(f"{name:<20}{before:>14.1f}{after:>12.1f}{before - after:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import csv
+import mmap
+import base64
+import struct
+import time
+from Crypto.PublicKey import RSA, ECC
+
+from key_loader import KeyStore, PreparedKeys
+
+# File layout (all integers little-endian):
+#   header        magic b'QKS1' | version u16 | reserved u16 | count u32
+#   offset table  (count + 1) x u64 absolute offsets; row i is offsets[i]:offsets[i + 1]
+#   rows          aes_key 32 | des_key 8 | tdes_key 24 | ecc d 32 | ecc x 32 | ecc y 32 |
+#                 u16 length + DER RSA private key | u16 length + DER RSA public key
+MAGIC = b'QKS1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+OFFSET = struct.Struct('<Q')
+FIXED_FIELDS = struct.Struct('<32s8s24s32s32s32s')
+LENGTH = struct.Struct('<H')
+
+def _count_rows(filename):
+    with open(filename, 'r', newline='') as csvfile:
+        return sum(1 for _ in csv.DictReader(csvfile))
+
+def _encode_row(enc_key_set, dec_key_set):
+    public_key_ecc_x, public_key_ecc_y = base64.b64decode(enc_key_set['public_key_ecc']).decode().split('|')
+    private_key_ecc_d = int(base64.b64decode(dec_key_set['private_key_ecc']).decode())
+    private_key_rsa = RSA.import_key(base64.b64decode(dec_key_set['private_key_rsa'])).export_key('DER')
+    public_key_rsa = RSA.import_key(base64.b64decode(enc_key_set['public_key_rsa'])).export_key('DER')
+
+    fixed = FIXED_FIELDS.pack(
+        base64.b64decode(enc_key_set['aes_key']),
+        base64.b64decode(enc_key_set['des_key']),
+        base64.b64decode(enc_key_set['tdes_key']),
+        private_key_ecc_d.to_bytes(32, 'big'),
+        int(public_key_ecc_x).to_bytes(32, 'big'),
+        int(public_key_ecc_y).to_bytes(32, 'big')
+    )
+    return b''.join((
+        fixed,
+        LENGTH.pack(len(private_key_rsa)), private_key_rsa,
+        LENGTH.pack(len(public_key_rsa)), public_key_rsa
+    ))
+
+def convert_csv_to_binary(enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv',
+                          out_filename='key_store.bin'):
+    """Convert the key CSV pair into the indexed binary format, one row at a time."""
+    count = min(_count_rows(enc_filename), _count_rows(dec_filename))
+    table_size = OFFSET.size * (count + 1)
+    offsets = []
+
+    tmp_filename = out_filename + '.tmp'
+    with open(enc_filename, 'r', newline='') as enc_file, \
+            open(dec_filename, 'r', newline='') as dec_file, \
+            open(tmp_filename, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, 0, count))
+        out.write(b'\0' * table_size)  # filled in once the row offsets are known
+
+        for _, enc_key_set, dec_key_set in zip(range(count), csv.DictReader(enc_file), csv.DictReader(dec_file)):
+            offsets.append(out.tell())
+            out.write(_encode_row(enc_key_set, dec_key_set))
+        offsets.append(out.tell())
+
+        out.seek(HEADER.size)
+        out.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+
+    os.replace(tmp_filename, out_filename)
+    print(f"Converted {count} key sets to {out_filename}")
+
+def _split_row(row_bytes):
+    """Return (fixed fields, private RSA DER, public RSA DER) of one row."""
+    try:
+        fixed = FIXED_FIELDS.unpack_from(row_bytes, 0)
+        private_start = FIXED_FIELDS.size + LENGTH.size
+        private_end = private_start + LENGTH.unpack_from(row_bytes, FIXED_FIELDS.size)[0]
+        public_start = private_end + LENGTH.size
+        public_end = public_start + LENGTH.unpack_from(row_bytes, private_end)[0]
+    except struct.error as e:
+        raise ValueError(f"Error preparing keys: {e}")
+    return fixed, row_bytes[private_start:private_end], row_bytes[public_start:public_end]
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def _row_span(mapped, index):
+    position = HEADER.size + index * OFFSET.size
+    return OFFSET.unpack_from(mapped, position)[0], OFFSET.unpack_from(mapped, position + OFFSET.size)[0]
+
+def _row_bytes(mapped, index):
+    start, end = _row_span(mapped, index)
+    return mapped[start:end]
+
+class BinaryKeyStore(KeyStore):
+    """KeyStore backed by a memory-mapped binary key file.
+
+    Opening the store only reads the header; get_keys(i) reads two offsets
+    and the bytes of row i, so start-up and lookup cost do not depend on the
+    number of key sets.
+    """
+
+    def __init__(self, filename='key_store.bin', max_cached=64):
+        super().__init__(max_cached=max_cached)
+        self.filename = filename
+        self._mmap = None
+        self._count = 0
+
+    def _files(self):
+        return (self.filename,)
+
+    def load(self):
+        """Map the file and read its header, keeping the prepared keys of rows that did not change."""
+        started = time.perf_counter()
+        mtimes = self._file_mtimes()
+        with open(self.filename, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or version != VERSION:
+            mapped.close()
+            raise ValueError(f"Unsupported key store file: {self.filename}")
+
+        old_mmap = self._mmap
+        old_count = self._count if old_mmap is not None else 0
+        changed = [
+            index for index in range(min(old_count, count))
+            if _row_bytes(mapped, index) != _row_bytes(old_mmap, index)
+        ]
+
+        with self._lock:
+            reloading = self._mtimes is not None
+            # The previous mapping is left to the garbage collector; rows
+            # being read from it by other threads stay valid.
+            self._mmap = mapped
+            self._count = count
+            self._mtimes = mtimes
+            self._discard_prepared(changed, count)
+        return self._reloaded(reloading, started, len(changed), count - old_count)
+
+    def _ensure_loaded(self):
+        if self._mmap is None:
+            with self._lock:
+                if self._mmap is None:
+                    self.load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return self._count
+
+    def get_row(self, index):
+        """Return a memoryview over the raw bytes of row `index`."""
+        self._ensure_loaded()
+        if index < 0 or index >= self._count:
+            raise IndexError("Index out of range")
+        mapped = self._mmap
+        start, end = _row_span(mapped, index)
+        return memoryview(mapped)[start:end]
+
+    def _read_row(self, index):
+        row = self.get_row(index)
+        try:
+            # One copy of the row (~1.6 KB); the key objects are built lazily from it
+            return bytes(row)
+        finally:
+            row.release()
+
+    def get_key_sets(self, index):
+        """Return row `index` as the (encryption, decryption) dicts of the CSV files.
+
+        Slower than get_keys(): the RSA keys are re-encoded to PEM. Only for
+        callers that need the CSV row format.
+        """
+        fixed, private_rsa, public_rsa = _split_row(self._read_row(index))
+        key_aes, key_des, key_tdes, ecc_d, ecc_x, ecc_y = fixed
+        symmetric = {'aes_key': _b64(key_aes), 'des_key': _b64(key_des), 'tdes_key': _b64(key_tdes)}
+        enc_key_set = dict(symmetric, **{
+            'public_key_rsa': _b64(RSA.import_key(public_rsa).export_key()),
+            'public_key_ecc': _b64(f"{int.from_bytes(ecc_x, 'big')}|{int.from_bytes(ecc_y, 'big')}".encode())
+        })
+        dec_key_set = dict(symmetric, **{
+            'private_key_rsa': _b64(RSA.import_key(private_rsa).export_key()),
+            'private_key_ecc': _b64(str(int.from_bytes(ecc_d, 'big')).encode())
+        })
+        return enc_key_set, dec_key_set
+
+    def _prepare_index(self, index):
+        fixed, private_rsa, public_rsa = _split_row(self._read_row(index))
+        key_aes, key_des, key_tdes, ecc_d, ecc_x, ecc_y = fixed
+
+        return PreparedKeys({
+            'aes': lambda: key_aes,
+            'des': lambda: key_des,
+            'tdes': lambda: key_tdes,
+            'private_rsa': lambda: RSA.import_key(private_rsa),
+            'public_rsa': lambda: RSA.import_key(public_rsa),
+            'private_ecc': lambda: ECC.construct(curve='P-256', d=int.from_bytes(ecc_d, 'big')),
+            'public_ecc': lambda: ECC.construct(
+                curve='P-256',
+                point_x=int.from_bytes(ecc_x, 'big'),
+                point_y=int.from_bytes(ecc_y, 'big')
+            )
+        })
+
+if __name__ == "__main__":
+    convert_csv_to_binary()
@@ -0,0 +1,110 @@
+import threading
+from encryption import compile_encryption_stages, run_encryption_stages, encode_wire
+from decryption import compile_decryption_stages, run_decryption_stages, decode_wire
+from sequence_utils import generate_hash, get_sequence_registry, resolve_sequence
+
+# PreparedKeys names for each key position of the encryption/decryption stage tables;
+# the RSA position gets the key set's cached OAEP cipher rather than the bare key
+ENCRYPTION_KEY_NAMES = ('aes', 'des', 'tdes', 'public_rsa_oaep', 'public_ecc')
+DECRYPTION_KEY_NAMES = ('aes', 'des', 'tdes', 'private_rsa_oaep', 'private_ecc')
+
+class CipherPlan:
+    """Compiled encryption and decryption chains for one method sequence.
+
+    Stage functions and key positions are resolved once, so encrypting or
+    decrypting with a plan does no per-layer string dispatch and no list
+    reversal. The plan also records which keys its layers use, so only
+    those are pulled out of a lazily prepared key set.
+    """
+
+    def __init__(self, methods, sequence_hash=None):
+        self.methods = tuple(methods)
+        self.sequence_hash = sequence_hash or generate_hash(", ".join(self.methods))
+        self.encryption_stages = compile_encryption_stages(self.methods)
+        self.decryption_stages = compile_decryption_stages(self.methods)
+        self.binary_encryption_stages = compile_encryption_stages(self.methods, True)
+        self.binary_decryption_stages = compile_decryption_stages(self.methods, True)
+        encryption_positions = {key_position for _, _, key_position in self.encryption_stages}
+        decryption_positions = {key_position for _, _, key_position, _ in self.decryption_stages}
+        self.encryption_key_names = tuple(
+            name if position in encryption_positions else None
+            for position, name in enumerate(ENCRYPTION_KEY_NAMES)
+        )
+        self.decryption_key_names = tuple(
+            name if position in decryption_positions else None
+            for position, name in enumerate(DECRYPTION_KEY_NAMES)
+        )
+
+    def encryption_keys(self, keys):
+        """Pick (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc) out of a
+        PreparedKeys, building only the keys this sequence uses; the rest are None."""
+        return tuple(keys.get(name) if name else None for name in self.encryption_key_names)
+
+    def decryption_keys(self, keys):
+        """Pick (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc) out of a
+        PreparedKeys, building only the keys this sequence uses; the rest are None."""
+        return tuple(keys.get(name) if name else None for name in self.decryption_key_names)
+
+    def encrypt(self, data, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc, binary=False):
+        """Same contract as encryption.encrypt_data."""
+        keys = (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc)
+        if not binary:
+            return run_encryption_stages(self.encryption_stages, data, keys)
+        ivs, encrypted_data, tags = run_encryption_stages(self.binary_encryption_stages, data.encode(), keys)
+        return encode_wire(ivs, encrypted_data, tags)
+
+    def decrypt(self, ivs, encrypted_data, tags, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary=False):
+        """Same contract as decryption.decrypt_data."""
+        keys = (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc)
+        if not binary:
+            return run_decryption_stages(self.decryption_stages, ivs, encrypted_data, tags, keys)
+        ivs, encrypted_data, tags = decode_wire(ivs, encrypted_data, tags)
+        return run_decryption_stages(self.binary_decryption_stages, ivs, encrypted_data, tags, keys).decode()
+
+    def encrypt_many(self, data_items, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc, binary=False):
+        """Same contract as encryption.encrypt_many."""
+        keys = (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc)
+        if not binary:
+            return [run_encryption_stages(self.encryption_stages, data, keys) for data in data_items]
+        return [encode_wire(*run_encryption_stages(self.binary_encryption_stages, data.encode(), keys))
+                for data in data_items]
+
+    def decrypt_many(self, messages, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary=False):
+        """Same contract as decryption.decrypt_many."""
+        keys = (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc)
+        if not binary:
+            return [run_decryption_stages(self.decryption_stages, ivs, encrypted_data, tags, keys)
+                    for ivs, encrypted_data, tags in messages]
+        return [run_decryption_stages(self.binary_decryption_stages, *decode_wire(ivs, encrypted_data, tags), keys).decode()
+                for ivs, encrypted_data, tags in messages]
+
+_plans = {}  # {sequence_hash: CipherPlan}
+_plans_lock = threading.Lock()
+
+def compile_plan(methods):
+    """Return the cached plan for a method sequence, compiling it on first use."""
+    sequence_hash = generate_hash(", ".join(methods))
+    plan = _plans.get(sequence_hash)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.setdefault(sequence_hash, CipherPlan(methods, sequence_hash))
+    return plan
+
+def get_plan_by_id(sequence_id, csv_file=None):
+    """Return the cached plan for a compact sequence ID (its index in the table)."""
+    methods, sequence_hash = resolve_sequence({"sequence_id": sequence_id}, get_sequence_registry(csv_file))
+    plan = _plans.get(sequence_hash)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.setdefault(sequence_hash, CipherPlan(methods, sequence_hash))
+    return plan
+
+def get_plan(sequence_hash, csv_file=None):
+    """Return the cached plan for a sequence hash, resolving it through the registry."""
+    # Always go through the registry so hashes removed from the table are rejected
+    methods = get_sequence_registry(csv_file).find_by_hash(sequence_hash)
+    plan = _plans.get(sequence_hash)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.setdefault(sequence_hash, CipherPlan(methods, sequence_hash))
+    return plan
@@ -16,6 +16,7 @@ from encryption import encrypt_data
 from decryption import decrypt_data
 from digital_signature import generate_signature, verify_signature
 from quantum_generator import get_random_sequence_from_csv
+from framing import FramedSocket
 
 # Configure logging
 logging.basicConfig(
@@ -97,14 +98,14 @@ class TankClientGUI:
                     except:
                         pass
                 
-                self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.client_socket = FramedSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
                 self.client_socket.settimeout(10)  # 10 second timeout
                 self.client_socket.connect(("localhost", 12345))
                 self.connected = True
                 self.log("Connected to server")
 
                 # Send tank ID
-                self.client_socket.send(self.username.encode())
+                self.client_socket.send_frame(self.username)
 
                 # Start message handler
                 threading.Thread(target=self.handle_server_messages, daemon=True).start()
@@ -129,9 +130,7 @@ class TankClientGUI:
         """Handle incoming server messages"""
         while self.connected:
             try:
-                message = self.client_socket.recv(1024).decode()
-                if not message:
-                    raise ConnectionError("Connection lost")
+                message = self.client_socket.read_text()
 
                 self.log(f"Received: {message}")
 
@@ -146,7 +145,7 @@ class TankClientGUI:
                         if self.auto_send_location:
                             self.restart_location_timer()
                 elif message == "Are you ready?":
-                    self.client_socket.send("yes".encode())
+                    self.client_socket.send_frame("yes")
                 elif message == "Give me your location":
                     self.send_location()
 
@@ -170,7 +169,7 @@ class TankClientGUI:
             
             response = self.calculate_challenge_response(challenge_type, challenge_num)
             if self.connected:
-                self.client_socket.send(str(response).encode())
+                self.client_socket.send_frame(str(response))
                 self.log("Challenge response sent")
                 
         except Exception as e:
@@ -236,7 +235,7 @@ class TankClientGUI:
 
             # Send encrypted location
             if self.connected:
-                self.client_socket.sendall(f"{json.dumps(payload)}\n".encode())
+                self.client_socket.send_frame(json.dumps(payload))
                 self.log("Location sent")
 
                 # Update map
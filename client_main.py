@@ -8,16 +8,22 @@ from tkintermapview import TkinterMapView
 import csv
 import time
 import json
+import queue
 import threading
 from datetime import datetime
 
 # Import cryptographic modules
-from key_loader import get_random_keys, get_keys_by_index
-from encryption import encrypt_data
+from key_loader import get_random_keys
+from key_rotation import get_key_ring
 from decryption import decrypt_data
 from digital_signature import generate_signature, verify_signature
-from quantum_generator import get_random_sequence_from_csv
-from sequence_utils import find_sequence_by_hash
+from quantum_generator import get_random_sequence, get_random_sequence_entry
+from sequence_utils import get_sequence_registry, resolve_sequence, sequence_reference
+from cipher_plan import compile_plan
+from session_crypto import create_session
+from framing import FramedSocket, frame_text
+from payload_codec import PAYLOAD_CODEC_VERSION, decode_payload, encode_payload, is_binary_payload
+from send_queue import BLOCK, DROP_OLDEST
 
 # Configure logging
 logging.basicConfig(
@@ -136,6 +142,26 @@ class TankClientGUI:
         self.connection_lock = threading.Lock()
         self.manual_send_button = None
         self.current_marker = None
+        self.session_mode = True  # Negotiate a session key after authentication
+        self.session = None
+        self.server_sequence_table = None  # fingerprint advertised in the server's challenge
+        self.sequence_ids = False  # send compact sequence IDs instead of hashes
+        self.server_payload_codec = None  # binary payload version advertised in the challenge
+        self.binary_payloads = False  # send payloads with payload_codec instead of JSON
+        # Push locations at the timer interval instead of answering server polls
+        self.location_streaming = True
+        self.stream_window = 16  # unacknowledged pushes allowed before updates are skipped
+        # Frames wait in a bounded queue for the connection's writer thread. Keep it
+        # larger than stream_window so streamed locations are skipped, not evicted.
+        self.send_queue_size = 64
+        self.chat_send_timeout = 5.0
+        self.streaming = False
+        self.stream_sent = 0
+        self.stream_acked = 0
+        self.last_streamed_location = None
+        # Budget for the sequences used on location pings (None = any sequence)
+        self.location_max_cost_us = None
+        self.location_max_bytes = None
 
         # Initialize log_area early to avoid NoneType errors
         self.log_area = None
@@ -224,9 +250,28 @@ class TankClientGUI:
         style.configure("Log.TFrame", background="#ffffff")
 
 
+    def _refresh_keys(self):
+        """Move to a key set of the current generation once keys have been rotated"""
+        if self.key_store.is_current(self.random_index):
+            return
+        self.random_index = self.key_store.select_random_index()
+        self.keys = self.key_store.get_keys(self.random_index)
+        (
+            self.key_aes,
+            self.key_des,
+            self.key_tdes,
+            self.private_key_rsa,
+            self.public_key_rsa,
+            self.private_key_ecc,
+            self.public_key_ecc
+        ) = self.keys
+        self.log(f"Switched to rotated key set {self.random_index}")
+
     def _initialize_crypto(self):
         """Initialize cryptographic components"""
         try:
+            self.key_store = get_key_ring()
+            self.sequence_registry = get_sequence_registry(None)
             keys = get_random_keys()
             (
                 self.key_aes,
@@ -238,8 +283,10 @@ class TankClientGUI:
                 self.public_key_ecc,
                 self.random_index
             ) = keys
+            # The PreparedKeys behind the tuple, which also caches the RSA schemes
+            self.keys = self.key_store.get_keys(self.random_index)
             
-            self.methods, self.sequence_hash = get_random_sequence_from_csv()
+            self.methods, self.sequence_hash = get_random_sequence()
             logging.info("Cryptography initialized successfully")
         except Exception as e:
             logging.error(f"Failed to initialize cryptography: {e}")
@@ -414,10 +461,11 @@ class TankClientGUI:
     def connect_to_server(self):
         """Connect to the server"""
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.client_socket = FramedSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                              send_queue_size=self.send_queue_size)
             self.client_socket.connect(('localhost', 5000))
             self.connected = True
-            self.client_socket.send(self.username.encode())
+            self.client_socket.send_frame(self.username)
             self.log("Connected to server")
         except Exception as e:
             self.log(f"Connection error: {e}", "ERROR")
@@ -500,38 +548,62 @@ class TankClientGUI:
             location = self.get_next_location()
             if not location:
                 return
-
-            # Get new encryption sequence for this location
-            methods, sequence_hash = get_random_sequence_from_csv()
-
-            # Create signature
-            signature = generate_signature(location, self.private_key_rsa)
-
-            # Encrypt location
-            ivs, encrypted_data, tags = encrypt_data(
-                location,
-                methods,
-                self.key_aes,
-                self.key_des,
-                self.key_tdes,
-                self.public_key_rsa,
-                self.public_key_ecc
+            if self.streaming:
+                if location == self.last_streamed_location:
+                    return  # Unchanged; nothing to push
+                if self.stream_sent - self.stream_acked >= self.stream_window:
+                    self.log("Stream window full; skipping location update", "WARNING")
+                    return
+
+            # Get new encryption sequence for this location, within the ping budget;
+            # the costs are calibrated in the background rather than on this thread
+            session = self.session
+            sequence_id, methods, sequence_hash = get_random_sequence_entry(
+                max_cost_us=self.location_max_cost_us,
+                max_bytes=self.location_max_bytes,
+                data_size=len(location),
+                session=session is not None,
+                wait=False
             )
 
+            # Create signature and encrypt location
+            if not session:
+                self._refresh_keys()
+            if session:
+                counter, signature = session.sign(location)
+                ivs, encrypted_data, tags = session.encrypt(location, methods)
+            else:
+                # The key set's cached signer and OAEP cipher; only the keys this sequence uses are built
+                plan = compile_plan(methods)
+                signature = generate_signature(location, self.keys.private_rsa_signer)
+                ivs, encrypted_data, tags = plan.encrypt(location, *plan.encryption_keys(self.keys), binary=True)
+
             # Prepare payload
             payload = {
                 "type": "location",
+                "format": "binary",
+                "session": session is not None,
                 "ivs": ivs,
                 "data": encrypted_data,
                 "tags": tags,
                 "signature": signature,
                 "random_index": self.random_index,
-                "sequence_hash": sequence_hash
+                **sequence_reference(sequence_id, sequence_hash, self.sequence_ids)
             }
+            if session:
+                payload["counter"] = counter
 
             # Send encrypted location
             if self.connected:
-                self.client_socket.sendall(f"{json.dumps(payload)}\n".encode())
+                # Only the newest positions matter, so a backed-up queue sheds the oldest
+                send_queue = self.client_socket.send_queue
+                dropped = send_queue.dropped if send_queue else 0
+                queued = self.client_socket.send_frame(encode_payload(payload, self.binary_payloads), DROP_OLDEST)
+                if self.streaming and queued:
+                    self.last_streamed_location = location
+                    # A frame that evicted an older one adds nothing for the server to ack
+                    if not (send_queue and send_queue.dropped > dropped):
+                        self.stream_sent += 1
                 self.log("Location sent")
 
                 # Update map
@@ -574,39 +646,44 @@ class TankClientGUI:
 
         try:
             # Get new encryption sequence for this message
-            methods, sequence_hash = get_random_sequence_from_csv()
-
-            # Create signature
-            signature = generate_signature(message, self.private_key_rsa)
-
-            # Encrypt message
-            ivs, encrypted_data, tags = encrypt_data(
-                message,
-                methods,
-                self.key_aes,
-                self.key_des,
-                self.key_tdes,
-                self.public_key_rsa,
-                self.public_key_ecc
-            )
+            sequence_id, methods, sequence_hash = get_random_sequence_entry()
+
+            # Create signature and encrypt message
+            session = self.session
+            if not session:
+                self._refresh_keys()
+            if session:
+                counter, signature = session.sign(message)
+                ivs, encrypted_data, tags = session.encrypt(message, methods)
+            else:
+                # The key set's cached signer and OAEP cipher; only the keys this sequence uses are built
+                plan = compile_plan(methods)
+                signature = generate_signature(message, self.keys.private_rsa_signer)
+                ivs, encrypted_data, tags = plan.encrypt(message, *plan.encryption_keys(self.keys), binary=True)
 
             # Prepare payload
             payload = {
                 "type": "chat",
+                "format": "binary",
+                "session": session is not None,
                 "ivs": ivs,
                 "data": encrypted_data,
                 "tags": tags,
                 "signature": signature,
                 "random_index": self.random_index,
-                "sequence_hash": sequence_hash,
+                **sequence_reference(sequence_id, sequence_hash, self.sequence_ids),
                 "sender": self.username
             }
-
-            # Send encrypted message
-            self.client_socket.sendall(f"{json.dumps(payload)}\n".encode())
-
-            # Add message to chat display
-            self.add_chat_message("You", message)
+            if session:
+                payload["counter"] = counter
+
+            # Queue the message off the Tk thread; a full send queue is reported when the put gives up
+            future = self.client_socket.send_frame_soon(
+                encode_payload(payload, self.binary_payloads),
+                BLOCK,
+                self.chat_send_timeout
+            )
+            future.add_done_callback(lambda done: self.root.after(0, self.chat_message_queued, done, message))
 
             # Clear input field
             self.message_input.delete(0, tk.END)
@@ -614,45 +691,51 @@ class TankClientGUI:
         except Exception as e:
             self.log(f"Error sending message: {e}", "ERROR")
 
+    def chat_message_queued(self, future, message):
+        """Show a chat message once it is queued, or report why it was not sent"""
+        try:
+            queued = future.result()
+        except queue.Full:
+            self.log("Send queue full; chat message not sent", "WARNING")
+            self.add_chat_message("System", f"Not sent (connection backed up): {message}")
+            return
+        except Exception as e:
+            self.log(f"Error sending message: {e}", "ERROR")
+            return
+
+        if self.streaming and queued:
+            self.stream_sent += 1
+
+        # Add message to chat display
+        self.add_chat_message("You", message)
+
     def receive_messages(self):
         """Handle incoming messages"""
         while self.connected:
             try:
-                data = ""
-                while self.connected:
-                    chunk = self.client_socket.recv(1024).decode()
-                    if not chunk:
-                        raise ConnectionError("Connection lost")
-                    
-                    data += chunk
-                    if "\n" in data:
-                        break
+                frame = self.client_socket.read_frame()
+                if is_binary_payload(frame):
+                    payload = decode_payload(frame)
+                    if payload.get("type") == "chat":
+                        self.handle_chat_payload(payload)
+                    continue
 
+                data = frame_text(frame).strip()
                 if not data:
                     continue
 
                 try:
-                    payload = json.loads(data.strip())
+                    payload = json.loads(data)
                     
                     if payload.get("type") == "chat":
-                        # Handle chat message
-                        decrypted_message = self.decrypt_message(payload)
-                        if decrypted_message:
-                            self.root.after(0, lambda: self.show_notification(
-                                "New Message",
-                                f"From {payload['sender']}: {decrypted_message[:50]}..."
-                            ))
-                            self.root.after(0, lambda: self.add_chat_message(
-                                payload['sender'],
-                                decrypted_message
-                            ))
+                        self.handle_chat_payload(payload)
                     else:
                         # Handle server commands
-                        self.handle_server_command(data.strip())
+                        self.handle_server_command(data)
 
                 except json.JSONDecodeError:
                     # Handle regular server commands
-                    self.handle_server_command(data.strip())
+                    self.handle_server_command(data)
 
             except Exception as e:
                 if self.connected:
@@ -661,21 +744,43 @@ class TankClientGUI:
                     self.authenticated = False
                 break
 
+    def handle_chat_payload(self, payload):
+        """Decrypt a chat payload from the server and show it"""
+        decrypted_message = self.decrypt_message(payload)
+        if decrypted_message:
+            self.root.after(0, lambda: self.show_notification(
+                "New Message",
+                f"From {payload['sender']}: {decrypted_message[:50]}..."
+            ))
+            self.root.after(0, lambda: self.add_chat_message(
+                payload['sender'],
+                decrypted_message
+            ))
+
     def decrypt_message(self, payload):
         """Decrypt incoming message"""
         try:
+            if payload.get("session"):
+                if not self.session:
+                    return None
+                methods, _ = resolve_sequence(payload, self.sequence_registry)
+                decrypted_message = self.session.decrypt(payload["ivs"], payload["data"], payload["tags"], methods)
+                if not self.session.verify(decrypted_message, payload["signature"], payload.get("counter")):
+                    return None
+                return decrypted_message
+
             index = payload["random_index"]
-            hash_value = payload["sequence_hash"]
-            methods = find_sequence_by_hash(hash_value)
+            methods, hash_value = resolve_sequence(payload, self.sequence_registry)
 
             if not methods:
                 return None
 
-            keys = get_keys_by_index(index)
+            keys = self.key_store.get_keys(index)
             if not keys or len(keys) != 7:
                 return None
 
-            key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc = keys
+            key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc = compile_plan(methods).decryption_keys(keys)
+            rsa_verifier = keys.public_rsa_verifier
 
             decrypted_message = decrypt_data(
                 payload["ivs"],
@@ -686,13 +791,14 @@ class TankClientGUI:
                 key_des,
                 key_tdes,
                 private_key_rsa,
-                private_key_ecc
+                private_key_ecc,
+                binary=payload.get("format") == "binary"
             )
 
             is_valid = verify_signature(
                 decrypted_message,
                 payload["signature"],
-                public_key_rsa
+                rsa_verifier
             )
 
             if not is_valid:
@@ -725,10 +831,19 @@ class TankClientGUI:
         """Handle incoming server messages"""
         while self.connected:
             try:
-                message = self.client_socket.recv(1024).decode()
-                if not message:
-                    raise ConnectionError("Connection lost")
+                frame = self.client_socket.read_frame()
+                if frame[:1] == b"{" or is_binary_payload(frame):
+                    # Chat pushed by the server between location requests
+                    payload = decode_payload(frame)
+                    if payload.get("type") == "chat":
+                        self.handle_chat_payload(payload)
+                    continue
 
+                message = frame_text(frame)
+                if message.startswith("Ack "):
+                    # Number of pushed payloads the server has received so far
+                    self.stream_acked = max(self.stream_acked, int(message[4:]))
+                    continue
                 self.log(f"Received: {message}")
 
                 if message.startswith("Challenge:"):
@@ -742,9 +857,12 @@ class TankClientGUI:
                         if self.auto_send_location:
                             self.restart_location_timer()
                 elif message == "Are you ready?":
-                    self.client_socket.send("yes".encode())
+                    self.send_readiness()
                 elif message == "Give me your location":
                     self.send_location()
+                elif message == "Stream accepted":
+                    self.streaming = True
+                    self.log(f"Streaming locations every {self.current_interval} seconds")
 
             except Exception as e:
                 self.log(f"Connection error: {e}", "ERROR")
@@ -777,14 +895,15 @@ class TankClientGUI:
                     except:
                         pass
                 
-                self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.client_socket = FramedSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                                  send_queue_size=self.send_queue_size)
                 self.client_socket.settimeout(10)  # 10 second timeout
                 self.client_socket.connect(("localhost", 5000))  # Updated port to match the server
                 self.connected = True
                 self.log("Connected to server")
 
                 # Send tank ID
-                self.client_socket.send(self.username.encode())
+                self.client_socket.send_frame(self.username)
 
                 # Start message handler
                 threading.Thread(target=self.handle_server_messages, daemon=True).start()
@@ -805,16 +924,58 @@ class TankClientGUI:
                     self.reconnect_attempts += 1
                     self.root.after(self.reconnect_delay * 1000, self.attempt_connection)
 
+    def send_readiness(self):
+        """Answer the server's readiness check, offering a session key if enabled"""
+        self.session = None
+        self._refresh_keys()
+        # Use compact sequence IDs only if the server has the same sequence table
+        sequence_table = self.sequence_registry.fingerprint()
+        self.sequence_ids = self.server_sequence_table == sequence_table
+        self.binary_payloads = self.server_payload_codec == PAYLOAD_CODEC_VERSION
+        # Streaming starts only once the server answers with "Stream accepted"
+        self.streaming = False
+        self.stream_sent = 0
+        self.stream_acked = 0
+        self.last_streamed_location = None
+
+        capabilities = {}
+        if self.sequence_ids:
+            capabilities["sequence_table"] = sequence_table
+        if self.binary_payloads:
+            capabilities["payload_codec"] = PAYLOAD_CODEC_VERSION
+        if self.location_streaming:
+            capabilities["stream"] = {"window": self.stream_window}
+
+        if not self.session_mode:
+            if capabilities:
+                self.client_socket.send_frame(json.dumps({"type": "ready", **capabilities}))
+            else:
+                self.client_socket.send_frame("yes")
+            return
+
+        session, offer = create_session(self.random_index, self.keys)
+        offer.update(capabilities)
+        self.client_socket.send_frame(json.dumps(offer))
+        self.session = session
+        self.log("Session key offered to server")
+
     def handle_challenge(self, message):
         """Handle authentication challenge"""
         try:
             parts = message.split(": ")[1].split()
+            self.server_sequence_table = None
+            self.server_payload_codec = None
+            for part in parts[2:]:
+                if part.startswith("sequence-table="):
+                    self.server_sequence_table = part.split("=", 1)[1]
+                elif part.startswith("payload-codec="):
+                    self.server_payload_codec = int(part.split("=", 1)[1])
             challenge_type = int(parts[0])
             challenge_num = int(parts[1]) if len(parts) > 1 else 0
             
             response = self.calculate_challenge_response(challenge_type, challenge_num)
             if self.connected:
-                self.client_socket.send(str(response).encode())
+                self.client_socket.send_frame(str(response))
                 self.log("Challenge response sent")
                 
         except Exception as e:
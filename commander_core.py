@@ -0,0 +1,332 @@
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from framing import MAX_FRAME_SIZE, encode_frame, read_frame_async
+from payload_codec import decode_payload
+from send_queue import ALWAYS, BLOCK, DROP_OLDEST, SendQueue
+
+READY_ANSWERS = ("yes", "ready", "ok")
+STREAM_ACCEPTED = "Stream accepted"
+
+class TankConnection:
+    """Thread-safe handle on one tank's framed stream.
+
+    Every outgoing frame goes through a bounded SendQueue drained by the
+    connection's writer task (write_loop), which coalesces whatever has
+    queued up into one write and waits for the transport to drain, so a
+    slow tank only ever holds up its own queue. send_frame() is for other
+    threads and applies an overflow policy; send_frame_soon() is for
+    threads that must never wait (chat from the GUI) and waits for room on
+    the event loop instead. write_frame() and read_frame() are for the
+    connection's own coroutine. Byte and frame counters cover both
+    directions.
+    """
+
+    def __init__(self, loop, reader, writer, max_frame_size=MAX_FRAME_SIZE, send_queue_size=64):
+        self._loop = loop
+        self._reader = reader
+        self._writer = writer
+        self.max_frame_size = max_frame_size
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()  # Set by the writer whenever it takes frames
+        self._deferred_lock = asyncio.Lock()  # Keeps send_frame_soon() frames in order
+        self.send_queue = SendQueue(send_queue_size, on_put=self._wake)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+
+    def _wake(self):
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def write_frame(self, data, policy=ALWAYS):
+        """Queue a frame from the event loop; only non-blocking policies may be used here."""
+        return self.send_queue.put(encode_frame(data, self.max_frame_size), policy)
+
+    def send_frame(self, data, policy=BLOCK, timeout=None):
+        """Queue a frame from any thread but the event loop's; returns False if it was dropped."""
+        return self.send_queue.put(encode_frame(data, self.max_frame_size), policy, timeout)
+
+    def send_frame_soon(self, data, timeout=None):
+        """Queue a BLOCK frame without blocking the calling thread.
+
+        Returns a concurrent.futures.Future that resolves once the frame is
+        queued, or raises queue.Full if there was no room within `timeout`.
+        """
+        frame = encode_frame(data, self.max_frame_size)
+        return asyncio.run_coroutine_threadsafe(self._put_when_room(frame, timeout), self._loop)
+
+    async def _put_when_room(self, frame, timeout):
+        async def put():
+            async with self._deferred_lock:
+                while True:
+                    try:
+                        return self.send_queue.put(frame, BLOCK, 0)
+                    except queue.Full:
+                        self._room.clear()
+                        await self._room.wait()
+        try:
+            return await asyncio.wait_for(put(), timeout)
+        except asyncio.TimeoutError:
+            raise queue.Full(f"Send queue full ({self.send_queue.max_frames} frames)")
+
+    async def write_loop(self):
+        """Write queued frames until the queue is closed and empty."""
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while True:
+                    frames = self.send_queue.take_all(0)
+                    if not frames:
+                        break
+                    self._room.set()
+                    data = b"".join(frames)
+                    self._writer.write(data)
+                    self.bytes_sent += len(data)
+                    self.frames_sent += len(frames)
+                    await self._writer.drain()
+                if self.send_queue.closed:
+                    return
+        except OSError:
+            # Stop accepting frames; closing the transport ends the reading side too
+            self.send_queue.close()
+            self._writer.close()
+        finally:
+            self._room.set()  # Lets pending send_frame_soon() calls see the closed queue
+
+    async def read_frame(self):
+        frame = await read_frame_async(self._reader, self.max_frame_size)
+        self.bytes_received += len(frame) + 4
+        self.frames_received += 1
+        return frame
+
+    async def read_text(self):
+        return (await self.read_frame()).decode()
+
+    def stats(self):
+        return {
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'frames_sent': self.frames_sent,
+            'frames_received': self.frames_received,
+            'send_queue': self.send_queue.stats()
+        }
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._writer.close)
+
+class CommanderServerCore:
+    """asyncio server running the tank protocol on its own event-loop thread.
+
+    Every connection (challenge, readiness exchange, location/chat stream)
+    is a coroutine on one loop, so thousands of idle tanks cost no OS
+    threads. Protocol decisions and crypto stay on `commander` (the
+    CommanderGUI): prepare_challenge, process_readiness and
+    process_tank_payload run in a thread pool so RSA/ECC work never blocks
+    the loop.
+
+    Tanks listed in `commander.tank_streams` push their updates instead of
+    being polled, and are acked with "Ack <n>" (n payloads received so far)
+    once `ack_every` payloads are unacknowledged, or by a timer every
+    `ack_interval` seconds. The timer also repeats the last ack after
+    `keepalive_interval` quiet seconds, so a tank that has nothing to push
+    (e.g. a stationary one) still hears from the commander before its
+    read timeout.
+
+    Each connection's outgoing frames are bounded to `send_queue_size`;
+    see TankConnection.
+
+    tank_connected, tank_disconnected and log are called on the loop
+    thread and the commander's other callbacks on pool threads, so
+    `commander` must hand any GUI work to its own thread rather than do it
+    in the callback.
+    """
+
+    def __init__(self, commander, host='localhost', port=5000, backlog=1024, crypto_workers=None,
+                 max_frame_size=MAX_FRAME_SIZE, ack_every=8, ack_interval=1.0, keepalive_interval=5.0,
+                 send_queue_size=64, flush_timeout=5.0):
+        self.commander = commander
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.max_frame_size = max_frame_size
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
+        self.keepalive_interval = keepalive_interval
+        self.send_queue_size = send_queue_size
+        self.flush_timeout = flush_timeout
+        self.executor = ThreadPoolExecutor(max_workers=crypto_workers, thread_name_prefix='tank-crypto')
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+
+    def start(self, timeout=10):
+        """Start listening; returns once the socket is bound or raises the bind error."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout):
+            raise TimeoutError("Server core did not start")
+        if self._start_error:
+            raise self._start_error
+
+    def stop(self, wait=True):
+        """Stop the loop; its thread then closes the listener and every tank connection.
+
+        With wait=False, return without waiting for that to finish (e.g.
+        from a GUI thread, which the commander callbacks may need).
+        """
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread and wait:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        loop = self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle_tank, self.host, self.port, backlog=self.backlog)
+            )
+        except Exception as e:
+            self._start_error = e
+            self._started.set()
+            loop.close()
+            self.executor.shutdown(wait=False)
+            return
+
+        self._started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+            self.executor.shutdown(wait=False)
+
+    async def _call(self, function, *args):
+        return await self._loop.run_in_executor(self.executor, function, *args)
+
+    async def _handle_tank(self, reader, writer):
+        tank_id = None
+        conn = TankConnection(self._loop, reader, writer, self.max_frame_size, self.send_queue_size)
+        write_task = self._loop.create_task(conn.write_loop())
+        try:
+            tank_id = (await conn.read_text()).strip()
+            if not tank_id:
+                return
+            self.commander.tank_connected(tank_id, conn)
+
+            # Generate and send challenge
+            challenge_msg, expected_answer = self.commander.prepare_challenge()
+            conn.write_frame(f"Challenge: {challenge_msg}")
+
+            # Handle authentication
+            response = (await conn.read_text()).strip()
+            if response != expected_answer:
+                conn.write_frame("Authentication Failed")
+                self.commander.log(f"Tank {tank_id} authentication failed")
+                return
+
+            conn.write_frame("Authentication Successful")
+            self.commander.log(f"Tank {tank_id} authenticated")
+            await self._communicate(conn, tank_id)
+
+        except asyncio.CancelledError:
+            # Server shutting down; finish normally so the stream callback has nothing to report
+            pass
+        except Exception as e:
+            self.commander.log(f"Communication error with Tank {tank_id}: {e}", "ERROR")
+        finally:
+            if tank_id:
+                self.commander.tank_disconnected(tank_id)
+                queue_stats = conn.send_queue.stats()
+                self.commander.log(
+                    f"Tank {tank_id} send queue: max depth {queue_stats['max_depth']}, "
+                    f"{queue_stats['dropped']} dropped, {queue_stats['frames_per_batch']:.1f} frames per write"
+                )
+            # Let the writer flush what is queued (e.g. "Authentication Failed") before closing
+            conn.send_queue.close()
+            try:
+                await asyncio.wait_for(write_task, self.flush_timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError, OSError):
+                write_task.cancel()
+            writer.close()
+
+    async def _communicate(self, conn, tank_id):
+        conn.write_frame("Are you ready?")
+
+        # A bare "yes", or a JSON session offer / capabilities frame
+        readiness = await conn.read_text()
+        readiness = await self._call(self.commander.process_readiness, readiness, tank_id)
+        if readiness.lower() not in READY_ANSWERS:
+            return
+
+        window = self.commander.tank_streams.get(tank_id)
+        if window:
+            await self._stream(conn, tank_id, window)
+            return
+
+        while True:
+            conn.write_frame("Give me your location")
+
+            frame = await conn.read_frame()
+            if not frame.strip():
+                continue
+
+            reply = await self._process(frame, tank_id)
+            if reply:
+                conn.write_frame(reply)
+
+    async def _stream(self, conn, tank_id, window):
+        """Receive pushed payloads, acking the count received so far instead of each one."""
+        # Ack at least twice per window so the tank never stalls on a full one
+        ack_every = max(1, min(self.ack_every, window // 2))
+        conn.write_frame(STREAM_ACCEPTED)
+        self.commander.log(f"Tank {tank_id} streaming (window {window}, ack every {ack_every})")
+
+        received = acked = 0
+        acked_at = self._loop.time()
+
+        def ack():
+            nonlocal acked, acked_at
+            # Acks are cumulative, so a newer one may replace one still queued
+            conn.write_frame(f"Ack {received}", DROP_OLDEST)
+            acked = received
+            acked_at = self._loop.time()
+
+        async def ack_timer():
+            while True:
+                await asyncio.sleep(self.ack_interval)
+                if received > acked or self._loop.time() - acked_at >= self.keepalive_interval:
+                    ack()
+
+        timer = self._loop.create_task(ack_timer())
+        try:
+            while True:
+                frame = await conn.read_frame()
+                received += 1
+                if frame.strip():
+                    await self._process(frame, tank_id)
+                if received - acked >= ack_every:
+                    ack()
+        finally:
+            timer.cancel()
+
+    async def _process(self, frame, tank_id):
+        try:
+            payload = decode_payload(frame)
+            return await self._call(self.commander.process_tank_payload, payload, tank_id)
+        except ValueError:
+            self.commander.log(f"Invalid payload from Tank {tank_id}", "ERROR")
+        except Exception as e:
+            self.commander.log(f"Error processing data from Tank {tank_id}: {e}", "ERROR")
+        return None
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from key_rotation import get_key_ring
+from generate_keys import get_worker_context
+from sequence_utils import get_sequence_registry
+from cipher_plan import get_plan, get_plan_by_id
+from table_watcher import TableWatcher
+from digital_signature import verify_signature
+
+def decrypt_payload(payload, key_store, csv_file=None):
+    """Decrypt a location/chat payload and check its signature.
+
+    Returns (plaintext, is_valid).
+    """
+    if "sequence_id" in payload:
+        plan = get_plan_by_id(payload["sequence_id"], csv_file)
+    else:
+        plan = get_plan(payload["sequence_hash"], csv_file)
+    keys = key_store.get_keys(payload["random_index"])
+    key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc = plan.decryption_keys(keys)
+
+    plaintext = plan.decrypt(
+        payload["ivs"],
+        payload["data"],
+        payload["tags"],
+        key_aes,
+        key_des,
+        key_tdes,
+        private_key_rsa,
+        private_key_ecc,
+        binary=payload.get("format") == "binary"
+    )
+    return plaintext, verify_signature(plaintext, payload["signature"], keys.public_rsa_verifier)
+
+# Per-process state, set up once by _init_worker
+_worker_key_store = None
+_worker_csv_file = None
+_worker_watcher = None
+
+def _init_worker(enc_filename, dec_filename, csv_file, watch_interval):
+    global _worker_key_store, _worker_csv_file, _worker_watcher
+    _worker_key_store = get_key_ring(enc_filename=enc_filename, dec_filename=dec_filename)
+    _worker_csv_file = csv_file
+    # Parse the tables and import the current keys now rather than on the first payload
+    _worker_key_store.prewarm_current()
+    registry = get_sequence_registry(csv_file)
+    len(registry)
+    if watch_interval:
+        _worker_watcher = TableWatcher([_worker_key_store, registry], interval=watch_interval)
+        _worker_watcher.start()
+
+def _decrypt_in_worker(payload):
+    return decrypt_payload(payload, _worker_key_store, _worker_csv_file)
+
+class DecryptionPool:
+    """Process pool that decrypts payloads off the GIL of the receiving process.
+
+    Each worker loads the key ring and sequence registry once at start-up,
+    follows key rotations through the manifest and, every `watch_interval`
+    seconds, reloads table entries whose files changed.
+    At most `queue_depth` payloads are in flight; submit() blocks once that
+    many are outstanding.
+    """
+
+    def __init__(self, workers=None, queue_depth=64, enc_filename='encryption_keys.csv',
+                 dec_filename='decryption_keys.csv', csv_file=None, watch_interval=1.0):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_worker_context(),
+            initializer=_init_worker,
+            initargs=(enc_filename, dec_filename, csv_file, watch_interval)
+        )
+
+    def submit(self, payload):
+        """Queue a payload; the future resolves to (plaintext, is_valid)."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(_decrypt_in_worker, payload)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,10 +1,14 @@
+import time
 import base64
+from functools import lru_cache
 from Crypto.Util.Padding import unpad
-from Crypto.Cipher import AES, DES, DES3, PKCS1_OAEP
+from Crypto.Cipher import AES, DES, DES3
 from Crypto.Protocol.KDF import HKDF
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import ECC
-from sequence_utils import find_sequence_by_hash
+from sequence_utils import get_sequence_registry
+import stage_hooks
+from key_loader import get_oaep_cipher
 
 # AES Decryption (GCM Mode)
 def aes_gcm_decrypt(nonce, ct, tag, key):
@@ -42,8 +46,7 @@ def tdes_decrypt(iv, ct, key):
 # RSA Decryption
 def rsa_decrypt(encrypted_data, private_key):
     encrypted_data = base64.b64decode(encrypted_data)
-    cipher = PKCS1_OAEP.new(private_key)
-    decrypted_data = cipher.decrypt(encrypted_data)
+    decrypted_data = get_oaep_cipher(private_key).decrypt(encrypted_data)
     return decrypted_data.decode()
 
 # ECC Decryption
@@ -77,42 +80,175 @@ def ecc_decrypt(encrypted_data, private_key):
     plaintext = cipher.decrypt_and_verify(ciphertext, tag)
     return plaintext.decode()
 
-def decrypt_data(ivs, encrypted_data, tags, methods, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc):
+# Binary layers: bytes-like in, bytes out, no base64 between stages
+def aes_gcm_decrypt_bytes(nonce, ct, tag, key):
+    cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+    return cipher.decrypt_and_verify(ct, tag)
+
+def aes_decrypt_bytes(iv, ct, key):
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    return unpad(cipher.decrypt(ct), AES.block_size)
+
+def des_decrypt_bytes(iv, ct, key):
+    cipher = DES.new(key, DES.MODE_CBC, iv)
+    return unpad(cipher.decrypt(ct), DES.block_size)
+
+def tdes_decrypt_bytes(iv, ct, key):
+    cipher = DES3.new(key, DES3.MODE_CBC, iv)
+    return unpad(cipher.decrypt(ct), DES3.block_size)
+
+def rsa_decrypt_bytes(encrypted_data, private_key):
+    return get_oaep_cipher(private_key).decrypt(encrypted_data)
+
+ECC_POINT_SIZE = 33  # compressed SEC1 P-256 point
+GCM_NONCE_SIZE = 16
+GCM_TAG_SIZE = 16
+
+def ecc_decrypt_bytes(encrypted_data, private_key):
+    """Reverse of encryption.ecc_encrypt_bytes."""
+    view = memoryview(encrypted_data)
+    nonce_end = ECC_POINT_SIZE + GCM_NONCE_SIZE
+    tag_end = nonce_end + GCM_TAG_SIZE
+    
+    ephemeral_pub = ECC.import_key(bytes(view[:ECC_POINT_SIZE]), curve_name='P-256')
+    shared_x = int((ephemeral_pub.pointQ * private_key.d).x)
+    shared_key = HKDF(shared_x.to_bytes(32, 'big'), 32, b'ECC-Encryption', SHA256)
+    
+    cipher = AES.new(shared_key, AES.MODE_GCM, nonce=view[ECC_POINT_SIZE:nonce_end])
+    return cipher.decrypt_and_verify(view[tag_end:], view[nonce_end:tag_end])
+
+# Stage adapters: every layer takes (data, iv, tag, key) and returns the inner data
+def _ecc_stage(data, iv, tag, key):
+    return ecc_decrypt(data, key)
+
+def _aes_stage(data, iv, tag, key):
+    return aes_decrypt(iv, data, key)
+
+def _aes_gcm_stage(data, iv, tag, key):
+    return aes_gcm_decrypt(iv, data, tag, key)
+
+def _des_stage(data, iv, tag, key):
+    return des_decrypt(iv, data, key)
+
+def _tdes_stage(data, iv, tag, key):
+    return tdes_decrypt(iv, data, key)
+
+def _rsa_stage(data, iv, tag, key):
+    return rsa_decrypt(data, key)
+
+# method -> (stage, position of its key in (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc))
+DECRYPTION_STAGES = {
+    'ecc': (_ecc_stage, 4),
+    'aes': (_aes_stage, 0),
+    'aes-gcm': (_aes_gcm_stage, 0),
+    'des': (_des_stage, 1),
+    'tdes': (_tdes_stage, 2),
+    'rsa': (_rsa_stage, 3),
+}
+
+def _ecc_stage_bytes(data, iv, tag, key):
+    return ecc_decrypt_bytes(data, key)
+
+def _aes_stage_bytes(data, iv, tag, key):
+    return aes_decrypt_bytes(iv, data, key)
+
+def _aes_gcm_stage_bytes(data, iv, tag, key):
+    return aes_gcm_decrypt_bytes(iv, data, tag, key)
+
+def _des_stage_bytes(data, iv, tag, key):
+    return des_decrypt_bytes(iv, data, key)
+
+def _tdes_stage_bytes(data, iv, tag, key):
+    return tdes_decrypt_bytes(iv, data, key)
+
+def _rsa_stage_bytes(data, iv, tag, key):
+    return rsa_decrypt_bytes(data, key)
+
+BINARY_DECRYPTION_STAGES = {
+    'ecc': (_ecc_stage_bytes, 4),
+    'aes': (_aes_stage_bytes, 0),
+    'aes-gcm': (_aes_gcm_stage_bytes, 0),
+    'des': (_des_stage_bytes, 1),
+    'tdes': (_tdes_stage_bytes, 2),
+    'rsa': (_rsa_stage_bytes, 3),
+}
+
+@lru_cache(maxsize=None)
+def compile_decryption_stages(methods, binary=False):
+    """Resolve a tuple of method names into (method, stage, key_position, layer) entries.
+
+    Entries are returned innermost-last, i.e. already in decryption order, and
+    `layer` is the index of the matching iv/tag in the encryption-order lists.
+    """
+    table = BINARY_DECRYPTION_STAGES if binary else DECRYPTION_STAGES
+    stages = []
+    for layer in range(len(methods) - 1, -1, -1):
+        method = methods[layer]
+        if method not in table:
+            raise ValueError(f"Unsupported decryption method: {method}")
+        stage, key_position = table[method]
+        stages.append((method, stage, key_position, layer))
+    return tuple(stages)
+
+def _from_wire(value):
+    # Payloads from the binary codec (payload_codec) already carry raw bytes
+    return base64.b64decode(value) if isinstance(value, str) else value
+
+def decode_wire(ivs, encrypted_data, tags):
+    """Undo encryption.encode_wire: base64-decode ivs, ciphertext and tags once."""
+    ivs = [_from_wire(iv) if iv is not None else None for iv in ivs]
+    tags = [_from_wire(tag) if tag is not None else None for tag in tags] if tags else tags
+    return ivs, _from_wire(encrypted_data), tags
+
+def run_decryption_stages(stages, ivs, encrypted_data, tags, keys):
+    """Run compiled decryption stages over `encrypted_data` with the given key tuple."""
     decrypted_data = encrypted_data
-    methods = list(reversed(methods))
-    ivs = list(reversed(ivs))
-    tags = list(reversed(tags)) if tags else [None] * len(methods)
+    tracing = stage_hooks.tracing_enabled()
     
-    print("\n--- Decryption Stages ---\n")
-    for i, method in enumerate(methods):
-        print(f"\nDecrypting with {method.upper()}...\n")
-        print(f"\nInput: {decrypted_data}\n")
-        
-        iv = ivs[i]
-        tag = tags[i]
-        
-        if method == 'ecc':
-            decrypted_data = ecc_decrypt(decrypted_data, private_key_ecc)
-        elif method == 'aes':
-            decrypted_data = aes_decrypt(iv, decrypted_data, key_aes)
-        elif method == 'aes-gcm':
-            decrypted_data = aes_gcm_decrypt(iv, decrypted_data, tag, key_aes)
-        elif method == 'des':
-            decrypted_data = des_decrypt(iv, decrypted_data, key_des)
-        elif method == 'tdes':
-            decrypted_data = tdes_decrypt(iv, decrypted_data, key_tdes)
-        elif method == 'rsa':
-            decrypted_data = rsa_decrypt(decrypted_data, private_key_rsa)
-            
-        print(f"Output: {decrypted_data}")
+    for method, stage, key_position, layer in stages:
+        iv = ivs[layer]
+        tag = tags[layer] if tags else None
+        if not tracing:
+            decrypted_data = stage(decrypted_data, iv, tag, keys[key_position])
+            continue
+        start = time.perf_counter_ns()
+        stage_output = stage(decrypted_data, iv, tag, keys[key_position])
+        stage_hooks.emit('decrypt', method, decrypted_data, stage_output, time.perf_counter_ns() - start)
+        decrypted_data = stage_output
     
     return decrypted_data
 
-def decrypt_with_hash(ivs, encrypted_data, tags, sequence_hash, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc):
+def decrypt_data(ivs, encrypted_data, tags, methods, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary=False):
+    """Decrypt `encrypted_data` through the layers in `methods`, outermost first.
+
+    binary=True accepts the output of encrypt_data(..., binary=True).
+    """
+    stages = compile_decryption_stages(tuple(methods), binary)
+    keys = (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc)
+    if not binary:
+        return run_decryption_stages(stages, ivs, encrypted_data, tags, keys)
+    ivs, encrypted_data, tags = decode_wire(ivs, encrypted_data, tags)
+    return run_decryption_stages(stages, ivs, encrypted_data, tags, keys).decode()
+
+def decrypt_many(messages, methods, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary=False):
+    """Decrypt several (ivs, encrypted_data, tags) triples sharing one key set and sequence.
+
+    Returns the plaintexts in input order.
+    """
+    stages = compile_decryption_stages(tuple(methods), binary)
+    keys = (key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc)
+    if not binary:
+        return [run_decryption_stages(stages, ivs, encrypted_data, tags, keys)
+                for ivs, encrypted_data, tags in messages]
+    return [run_decryption_stages(stages, *decode_wire(ivs, encrypted_data, tags), keys).decode()
+            for ivs, encrypted_data, tags in messages]
+
+def decrypt_with_hash(ivs, encrypted_data, tags, sequence_hash, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary=False):
     """Decrypt data using the sequence identified by its hash."""
     # Find the encryption sequence using the hash
-    methods = find_sequence_by_hash(sequence_hash)
-    print(f"Found encryption sequence: {' -> '.join(methods)}")
+    methods = get_sequence_registry().find_by_hash(sequence_hash)
+    if stage_hooks.debug_enabled():
+        print(f"Found encryption sequence: {' -> '.join(methods)}")
     
     # Decrypt using the identified sequence
-    return decrypt_data(ivs, encrypted_data, tags, methods, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc)
\ No newline at end of file
+    return decrypt_data(ivs, encrypted_data, tags, methods, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc, binary)
\ No newline at end of file
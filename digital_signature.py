@@ -1,7 +1,7 @@
 import base64
 from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
+from key_loader import get_pkcs1_15_scheme
 
 def generate_signature(data, private_key):
     """
@@ -9,7 +9,7 @@ def generate_signature(data, private_key):
     
     Args:
         data (str): The data to sign
-        private_key: RSA private key object
+        private_key: RSA private key object, or its pkcs1_15 signer
     
     Returns:
         str: Base64 encoded signature
@@ -18,7 +18,7 @@ def generate_signature(data, private_key):
     h = SHA256.new(data.encode())
     
     # Sign the hash with the private key
-    signature = pkcs1_15.new(private_key).sign(h)
+    signature = get_pkcs1_15_scheme(private_key).sign(h)
     
     # Return the base64 encoded signature
     return base64.b64encode(signature).decode('utf-8')
@@ -29,21 +29,23 @@ def verify_signature(data, signature, public_key):
     
     Args:
         data (str): The data that was signed
-        signature (str): Base64 encoded signature
-        public_key: RSA public key object
+        signature (str or bytes): Base64 encoded signature, or the raw bytes
+            from a binary payload
+        public_key: RSA public key object, or its pkcs1_15 verifier
     
     Returns:
         bool: True if signature is valid, False otherwise
     """
     # Decode the signature from base64
-    signature = base64.b64decode(signature)
+    if isinstance(signature, str):
+        signature = base64.b64decode(signature)
     
     # Create a hash of the data
     h = SHA256.new(data.encode())
     
     try:
         # Verify the signature
-        pkcs1_15.new(public_key).verify(h, signature)
+        get_pkcs1_15_scheme(public_key).verify(h, signature)
         return True
     except (ValueError, TypeError):
         return False
\ No newline at end of file
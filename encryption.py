@@ -1,8 +1,15 @@
+import time
 import base64
+import threading
+from functools import lru_cache
 from Crypto.Util.Padding import pad
-from Crypto.Cipher import AES, DES, DES3, PKCS1_OAEP
+from Crypto.Cipher import AES, DES, DES3
 from Crypto.Protocol.KDF import HKDF
 from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC
+import stage_hooks
+from key_loader import get_oaep_cipher
+from refill_pool import RefillPool
 
 # AES Encryption (GCM Mode)
 def aes_gcm_encrypt(data, key):
@@ -39,15 +46,50 @@ def tdes_encrypt(data, key):
 
 # RSA Encryption
 def rsa_encrypt(data, public_key):
-    cipher = PKCS1_OAEP.new(public_key)
-    encrypted_data = cipher.encrypt(data.encode())
+    encrypted_data = get_oaep_cipher(public_key).encrypt(data.encode())
     return base64.b64encode(encrypted_data).decode('utf-8')
 
+class EphemeralKeyPool(RefillPool):
+    """Background-filled pool of one-time P-256 ephemeral keys for the ECC layer.
+
+    See refill_pool.RefillPool for the refill thread and watermarks. Every
+    key is handed out exactly once; when the pool is empty take() generates
+    one inline and counts a miss. Entries are (key, compressed SEC1 public
+    point).
+    """
+
+    thread_name = 'ecc-ephemeral-pool'
+
+    def __init__(self, low_watermark=16, high_watermark=128, curve='P-256'):
+        super().__init__(low_watermark, high_watermark)
+        self.curve = curve
+
+    def produce(self):
+        key = ECC.generate(curve=self.curve)
+        return key, key.public_key().export_key(format='SEC1', compress=True)
+
+    @property
+    def depth(self):
+        return len(self)
+
+_ephemeral_key_pool = None
+_ephemeral_key_pool_lock = threading.Lock()
+
+def get_ephemeral_key_pool():
+    """Return the shared, running ephemeral key pool."""
+    global _ephemeral_key_pool
+    if _ephemeral_key_pool is None:
+        with _ephemeral_key_pool_lock:
+            if _ephemeral_key_pool is None:
+                pool = EphemeralKeyPool()
+                pool.start()
+                _ephemeral_key_pool = pool
+    return _ephemeral_key_pool
+
 # ECC Encryption
 def ecc_encrypt(data, public_key):
-    # Generate an ephemeral key pair
-    from Crypto.PublicKey import ECC
-    ephemeral_key = ECC.generate(curve='P-256')
+    # Take a one-time ephemeral key pair from the pool
+    ephemeral_key, _ = get_ephemeral_key_pool().take()
     shared_point = (public_key.pointQ * ephemeral_key.d).x
     
     # Derive a symmetric key using HKDF
@@ -74,41 +116,159 @@ def ecc_encrypt(data, public_key):
     # Combine all components into a single string
     return '|'.join(f"{k}:{v}" for k, v in enc_components.items())
 
-def encrypt_data(data, methods, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc):
+# Binary layers: bytes in, bytes out, no base64 between stages
+def aes_gcm_encrypt_bytes(data, key):
+    cipher = AES.new(key, AES.MODE_GCM)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return cipher.nonce, ciphertext, tag
+
+def aes_encrypt_bytes(data, key):
+    cipher = AES.new(key, AES.MODE_CBC)
+    return cipher.iv, cipher.encrypt(pad(data, AES.block_size))
+
+def des_encrypt_bytes(data, key):
+    cipher = DES.new(key, DES.MODE_CBC)
+    return cipher.iv, cipher.encrypt(pad(data, DES.block_size))
+
+def tdes_encrypt_bytes(data, key):
+    cipher = DES3.new(key, DES3.MODE_CBC)
+    return cipher.iv, cipher.encrypt(pad(data, DES3.block_size))
+
+def rsa_encrypt_bytes(data, public_key):
+    return get_oaep_cipher(public_key).encrypt(data)
+
+def ecc_encrypt_bytes(data, public_key):
+    """ECIES-style layer: compressed SEC1 ephemeral point | nonce | tag | ciphertext."""
+    ephemeral_key, ephemeral_point = get_ephemeral_key_pool().take()
+    shared_x = int((public_key.pointQ * ephemeral_key.d).x)
+    shared_key = HKDF(shared_x.to_bytes(32, 'big'), 32, b'ECC-Encryption', SHA256)
+    
+    cipher = AES.new(shared_key, AES.MODE_GCM)
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return b''.join((ephemeral_point, cipher.nonce, tag, ciphertext))
+
+# Stage adapters: every layer takes (data, key) and returns (iv, data, tag)
+def _ecc_stage(data, key):
+    return None, ecc_encrypt(data, key), None
+
+def _aes_stage(data, key):
+    iv, ct = aes_encrypt(data, key)
+    return iv, ct, None
+
+def _aes_gcm_stage(data, key):
+    return aes_gcm_encrypt(data, key)
+
+def _des_stage(data, key):
+    iv, ct = des_encrypt(data, key)
+    return iv, ct, None
+
+def _tdes_stage(data, key):
+    iv, ct = tdes_encrypt(data, key)
+    return iv, ct, None
+
+def _rsa_stage(data, key):
+    return None, rsa_encrypt(data, key), None
+
+# method -> (stage, position of its key in (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc))
+ENCRYPTION_STAGES = {
+    'ecc': (_ecc_stage, 4),
+    'aes': (_aes_stage, 0),
+    'aes-gcm': (_aes_gcm_stage, 0),
+    'des': (_des_stage, 1),
+    'tdes': (_tdes_stage, 2),
+    'rsa': (_rsa_stage, 3),
+}
+
+def _ecc_stage_bytes(data, key):
+    return None, ecc_encrypt_bytes(data, key), None
+
+def _aes_stage_bytes(data, key):
+    iv, ct = aes_encrypt_bytes(data, key)
+    return iv, ct, None
+
+def _des_stage_bytes(data, key):
+    iv, ct = des_encrypt_bytes(data, key)
+    return iv, ct, None
+
+def _tdes_stage_bytes(data, key):
+    iv, ct = tdes_encrypt_bytes(data, key)
+    return iv, ct, None
+
+def _rsa_stage_bytes(data, key):
+    return None, rsa_encrypt_bytes(data, key), None
+
+BINARY_ENCRYPTION_STAGES = {
+    'ecc': (_ecc_stage_bytes, 4),
+    'aes': (_aes_stage_bytes, 0),
+    'aes-gcm': (aes_gcm_encrypt_bytes, 0),
+    'des': (_des_stage_bytes, 1),
+    'tdes': (_tdes_stage_bytes, 2),
+    'rsa': (_rsa_stage_bytes, 3),
+}
+
+@lru_cache(maxsize=None)
+def compile_encryption_stages(methods, binary=False):
+    """Resolve a tuple of method names into (method, stage, key_position) entries."""
+    table = BINARY_ENCRYPTION_STAGES if binary else ENCRYPTION_STAGES
+    stages = []
+    for method in methods:
+        if method not in table:
+            raise ValueError(f"Unsupported encryption method: {method}")
+        stage, key_position = table[method]
+        stages.append((method, stage, key_position))
+    return tuple(stages)
+
+def encode_wire(ivs, encrypted_data, tags):
+    """Base64 the raw output of the binary pipeline once, for the JSON payload."""
+    ivs = [base64.b64encode(iv).decode('utf-8') if iv is not None else None for iv in ivs]
+    tags = [base64.b64encode(tag).decode('utf-8') if tag is not None else None for tag in tags]
+    return ivs, base64.b64encode(encrypted_data).decode('utf-8'), tags
+
+def run_encryption_stages(stages, data, keys):
+    """Run compiled encryption stages over `data` with the given key tuple."""
     encrypted_data = data
     ivs = []
     tags = []
     
-    print("\n--- Encryption Stages ---")
-    for method in methods:
-        print(f"\nEncrypting with {method.upper()}...\n")
-        print(f"\nInput: {encrypted_data}\n")
-        
-        if method == 'ecc':
-            encrypted_data = ecc_encrypt(encrypted_data, public_key_ecc)
-            ivs.append(None)
-            tags.append(None)
-        elif method == 'aes':
-            iv, encrypted_data = aes_encrypt(encrypted_data, key_aes)
+    if not stage_hooks.tracing_enabled():
+        for method, stage, key_position in stages:
+            iv, encrypted_data, tag = stage(encrypted_data, keys[key_position])
             ivs.append(iv)
-            tags.append(None)
-        elif method == 'aes-gcm':
-            nonce, encrypted_data, tag = aes_gcm_encrypt(encrypted_data, key_aes)
-            ivs.append(nonce)
             tags.append(tag)
-        elif method == 'des':
-            iv, encrypted_data = des_encrypt(encrypted_data, key_des)
-            ivs.append(iv)
-            tags.append(None)
-        elif method == 'tdes':
-            iv, encrypted_data = tdes_encrypt(encrypted_data, key_tdes)
-            ivs.append(iv)
-            tags.append(None)
-        elif method == 'rsa':
-            encrypted_data = rsa_encrypt(encrypted_data, public_key_rsa)
-            ivs.append(None)
-            tags.append(None)
-            
-        print(f"Output: {encrypted_data}")
+        return ivs, encrypted_data, tags
     
-    return ivs, encrypted_data, tags
\ No newline at end of file
+    for method, stage, key_position in stages:
+        start = time.perf_counter_ns()
+        iv, stage_output, tag = stage(encrypted_data, keys[key_position])
+        stage_hooks.emit('encrypt', method, encrypted_data, stage_output, time.perf_counter_ns() - start)
+        encrypted_data = stage_output
+        ivs.append(iv)
+        tags.append(tag)
+    
+    return ivs, encrypted_data, tags
+
+def encrypt_data(data, methods, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc, binary=False):
+    """Encrypt `data` through every layer in `methods`.
+
+    With binary=True the layers pass raw bytes to each other and only the
+    final ivs, ciphertext and tags are base64-encoded; the receiver must then
+    call decrypt_data with binary=True (payload "format": "binary").
+    """
+    stages = compile_encryption_stages(tuple(methods), binary)
+    keys = (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc)
+    if not binary:
+        return run_encryption_stages(stages, data, keys)
+    ivs, encrypted_data, tags = run_encryption_stages(stages, data.encode(), keys)
+    return encode_wire(ivs, encrypted_data, tags)
+
+def encrypt_many(data_items, methods, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc, binary=False):
+    """Encrypt several plaintexts under one key set and sequence.
+
+    The sequence is compiled and the key tuple built once for the whole
+    batch. Returns a list of (ivs, encrypted_data, tags) in input order.
+    """
+    stages = compile_encryption_stages(tuple(methods), binary)
+    keys = (key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc)
+    if not binary:
+        return [run_encryption_stages(stages, data, keys) for data in data_items]
+    return [encode_wire(*run_encryption_stages(stages, data.encode(), keys)) for data in data_items]
\ No newline at end of file
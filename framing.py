@@ -0,0 +1,176 @@
+import socket
+import struct
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from send_queue import BLOCK, SendQueue
+
+# Every message is a 4-byte big-endian length followed by that many bytes
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 1 << 20
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+class FrameTooLarge(ValueError):
+    pass
+
+def encode_frame(data, max_frame_size=MAX_FRAME_SIZE):
+    """Return `data` (str or bytes) with its length header prepended."""
+    if isinstance(data, str):
+        data = data.encode()
+    if len(data) > max_frame_size:
+        raise FrameTooLarge(f"Frame of {len(data)} bytes exceeds the {max_frame_size} byte limit")
+    return FRAME_HEADER.pack(len(data)) + data
+
+def frame_text(frame):
+    return str(frame, 'utf-8')
+
+class FramedSocket:
+    """Length-prefixed frames over a connected stream socket.
+
+    Incoming bytes are read with recv_into() straight into one preallocated
+    bytearray, and read_frame() hands out memoryview slices of it, so a
+    message is never copied or re-decoded while it is being assembled. A
+    frame returned by read_frame() is only valid until the next call.
+    Sends are serialized, so several threads may share one connection.
+
+    With `send_queue_size` set, send_frame() only queues the frame (see
+    send_queue.SendQueue for the overflow policies) and a writer thread
+    sends whatever has queued up in one sendall(), so a slow link never
+    stalls the sending thread. A failed write closes the socket, which the
+    reading side sees as a lost connection. send_frame_soon() is for
+    threads that must never wait, such as the GUI's.
+    """
+
+    def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE,
+                 send_queue_size=0):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First unread byte
+        self._end = 0  # End of the received bytes
+        self._send_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.send_queue = None
+        self._deferred_sender = None
+        if send_queue_size:
+            self.send_queue = SendQueue(send_queue_size)
+            threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def send_frame(self, data, policy=BLOCK, timeout=None):
+        """Send a frame, or queue it with the given overflow policy; returns False if it was dropped."""
+        frame = encode_frame(data, self.max_frame_size)
+        if self.send_queue is not None:
+            return self.send_queue.put(frame, policy, timeout)
+        with self._send_lock:
+            self.sock.sendall(frame)
+            self.bytes_sent += len(frame)
+            self.frames_sent += 1
+        return True
+
+    def send_frame_soon(self, data, policy=BLOCK, timeout=None):
+        """send_frame() on a helper thread; returns a concurrent.futures.Future of its result.
+
+        Frames handed over this way are sent or queued one at a time, in order.
+        """
+        with self._send_lock:
+            if self._deferred_sender is None:
+                self._deferred_sender = ThreadPoolExecutor(max_workers=1, thread_name_prefix='deferred-send')
+        return self._deferred_sender.submit(self.send_frame, data, policy, timeout)
+
+    def _write_loop(self):
+        try:
+            while True:
+                frames = self.send_queue.take_all()
+                if not frames:
+                    return
+                data = b"".join(frames)
+                self.sock.sendall(data)
+                self.bytes_sent += len(data)
+                self.frames_sent += len(frames)
+        except OSError:
+            self.send_queue.close()
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _make_room(self, needed):
+        buffered = self._end - self._start
+        if needed > len(self._buffer):
+            # Only frames bigger than the buffer get here; swap in a larger one
+            buffer = bytearray(max(needed, 2 * len(self._buffer)))
+            buffer[:buffered] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        else:
+            self._view[:buffered] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = buffered
+
+    def _fill(self, needed):
+        """Receive until at least `needed` unread bytes are buffered."""
+        if self._start + needed > len(self._buffer):
+            self._make_room(needed)
+        while self._end - self._start < needed:
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionError("Connection lost")
+            self._end += received
+            self.bytes_received += received
+
+    def read_frame(self):
+        """Return the next frame as a memoryview into the receive buffer."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        self._fill(FRAME_HEADER.size)
+        length = FRAME_HEADER.unpack_from(self._buffer, self._start)[0]
+        if length > self.max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes exceeds the {self.max_frame_size} byte limit")
+        self._fill(FRAME_HEADER.size + length)
+        start = self._start + FRAME_HEADER.size
+        self._start = start + length
+        self.frames_received += 1
+        return self._view[start:self._start]
+
+    def read_text(self):
+        return frame_text(self.read_frame())
+
+    def stats(self):
+        stats = {
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'frames_sent': self.frames_sent,
+            'frames_received': self.frames_received
+        }
+        if self.send_queue is not None:
+            stats['send_queue'] = self.send_queue.stats()
+        return stats
+
+    def connect(self, address):
+        self.sock.connect(address)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        if self.send_queue is not None:
+            self.send_queue.close()
+        if self._deferred_sender is not None:
+            self._deferred_sender.shutdown(wait=False, cancel_futures=True)
+        self.sock.close()
+
+async def read_frame_async(reader, max_frame_size=MAX_FRAME_SIZE):
+    """Read one frame from an asyncio StreamReader; returns its bytes."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length = FRAME_HEADER.unpack(header)[0]
+        if length > max_frame_size:
+            raise FrameTooLarge(f"Frame of {length} bytes exceeds the {max_frame_size} byte limit")
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection lost")
@@ -2,6 +2,20 @@ import os
 import base64
 from Crypto.PublicKey import RSA, ECC
 import csv
+import argparse
+import multiprocessing
+
+def get_worker_context():
+    """Process start method for worker pools.
+
+    The servers and the key rotator create pools from processes that
+    already run threads, and forking those can copy a held lock into the
+    child. forkserver (spawn where it is unavailable) starts workers from
+    a clean process instead.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
 
 def generate_key_set():
     # Generate AES key (256 bits)
@@ -42,46 +56,164 @@ def generate_key_set():
     
     return encryption_keys, decryption_keys
 
-def generate_keys_csv(num_sets=20, enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv'):
-    # Define the CSV headers
-    encryption_headers = [
-        'aes_key',
-        'des_key',
-        'tdes_key',
-        'public_key_rsa',
-        'public_key_ecc'
-    ]
-    
-    decryption_headers = [
-        'aes_key',
-        'des_key',
-        'tdes_key',
-        'private_key_rsa',
-        'private_key_ecc'
-    ]
-    
-    # Generate the specified number of key sets
-    encryption_key_sets = []
-    decryption_key_sets = []
-    
-    for _ in range(num_sets):
-        enc_keys, dec_keys = generate_key_set()
-        encryption_key_sets.append(enc_keys)
-        decryption_key_sets.append(dec_keys)
-    
-    # Write the encryption key sets to a CSV file
-    with open(enc_filename, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=encryption_headers)
-        writer.writeheader()
-        writer.writerows(encryption_key_sets)
-    
-    # Write the decryption key sets to a CSV file
-    with open(dec_filename, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=decryption_headers)
+ENCRYPTION_HEADERS = [
+    'aes_key',
+    'des_key',
+    'tdes_key',
+    'public_key_rsa',
+    'public_key_ecc'
+]
+
+DECRYPTION_HEADERS = [
+    'aes_key',
+    'des_key',
+    'tdes_key',
+    'private_key_rsa',
+    'private_key_ecc'
+]
+
+def _generate_key_set_worker(_):
+    return generate_key_set()
+
+def _valid_row(line, headers):
+    # Every field is non-empty base64 (no quoting needed), and a row written
+    # completely ends with its line terminator
+    if not line.endswith(b'\n'):
+        return False
+    fields = line.rstrip(b'\r\n').split(b',')
+    if len(fields) != len(headers):
+        return False
+    try:
+        return all(field and base64.b64decode(field, validate=True) for field in fields)
+    except ValueError:
+        return False
+
+def _scan_rows(filename, headers, limit=None):
+    """Return (rows, end offset) for the complete rows of `filename`, at most `limit`.
+
+    Reading stops before a partly written last row; any other malformed
+    row raises ValueError. Returns (0, None) if the file is missing or its
+    header is not `headers`.
+    """
+    if not os.path.exists(filename):
+        return 0, None
+    with open(filename, 'rb') as csvfile:
+        if csvfile.readline().rstrip(b'\r\n') != ','.join(headers).encode():
+            return 0, None
+        rows = 0
+        end = csvfile.tell()
+        while limit is None or rows < limit:
+            line = csvfile.readline()
+            if not line:
+                break
+            if not _valid_row(line, headers):
+                # Only the last line can lack its terminator
+                if line.endswith(b'\n'):
+                    raise ValueError(f"{filename}: row {rows + 1} is malformed")
+                break
+            rows += 1
+            end = csvfile.tell()
+    return rows, end
+
+def _resume_point(enc_filename, dec_filename, num_sets):
+    """Return (key sets kept, encryption file end, decryption file end) for a resume.
+
+    Only what an interrupted run leaves behind is trimmed: a partly written
+    last row, or a last set that reached one file but not the other.
+    Raises ValueError instead of dropping complete sets, i.e. if either
+    file holds more than `num_sets` rows, their row counts differ by more
+    than one, or only one of them has rows.
+    """
+    enc_rows, enc_end = _scan_rows(enc_filename, ENCRYPTION_HEADERS)
+    dec_rows, dec_end = _scan_rows(dec_filename, DECRYPTION_HEADERS)
+    if (enc_rows or dec_rows) and (enc_end is None or dec_end is None):
+        missing = enc_filename if enc_end is None else dec_filename
+        raise ValueError(f"Cannot resume: {missing} is missing or has the wrong header")
+    if abs(enc_rows - dec_rows) > 1:
+        raise ValueError(f"Cannot resume: {enc_filename} has {enc_rows} key sets "
+                         f"but {dec_filename} has {dec_rows}")
+    if max(enc_rows, dec_rows) > num_sets:
+        raise ValueError(f"Cannot resume: the key files already hold more than {num_sets} key sets")
+
+    existing = min(enc_rows, dec_rows)
+    if enc_rows > existing:
+        enc_end = _scan_rows(enc_filename, ENCRYPTION_HEADERS, existing)[1]
+    if dec_rows > existing:
+        dec_end = _scan_rows(dec_filename, DECRYPTION_HEADERS, existing)[1]
+    return existing, enc_end, dec_end
+
+def _prepare_output(filename, headers, end):
+    """Open `filename` for appending after offset `end`, or start it afresh if `end` is None.
+
+    The file is truncated in place at `end`, so a crash here never loses
+    the rows before it.
+    """
+    if end is None:
+        csvfile = open(filename, 'w', newline='')
+        writer = csv.DictWriter(csvfile, fieldnames=headers)
         writer.writeheader()
-        writer.writerows(decryption_key_sets)
+    else:
+        os.truncate(filename, end)
+        csvfile = open(filename, 'a', newline='')
+        writer = csv.DictWriter(csvfile, fieldnames=headers)
+    csvfile.flush()
+    return csvfile, writer
+
+def _print_progress(done, total):
+    print(f"\rGenerated {done}/{total} key sets", end='' if done < total else '\n', flush=True)
+
+def generate_keys_csv(num_sets=20, enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv',
+                      workers=None, resume=False, progress=_print_progress):
+    """Generate `num_sets` key sets into the two CSV files.
+
+    RSA/ECC generation runs in a pool of `workers` processes (default: one
+    per CPU; 1 generates in-process). Each set is appended to both files as
+    soon as it is ready, so memory use does not grow with num_sets. With
+    resume=True the sets already present in both files are kept and only the
+    missing ones are generated; the partial last set of an interrupted run
+    is discarded, and files that do not look like one raise ValueError.
+    `progress(done, num_sets)` is called after every written set.
+    """
+    existing, enc_end, dec_end = 0, None, None
+    if resume:
+        existing, enc_end, dec_end = _resume_point(enc_filename, dec_filename, num_sets)
+
+    # Cut both files back to the last complete set so they stay row-aligned
+    enc_file, enc_writer = _prepare_output(enc_filename, ENCRYPTION_HEADERS, enc_end)
+    dec_file, dec_writer = _prepare_output(dec_filename, DECRYPTION_HEADERS, dec_end)
+
+    remaining = num_sets - existing
+    if existing:
+        print(f"Resuming with {existing} existing key sets")
+
+    pool = get_worker_context().Pool(workers) if workers != 1 else None
+    try:
+        if pool:
+            key_sets = pool.imap_unordered(_generate_key_set_worker, range(remaining))
+        else:
+            key_sets = map(_generate_key_set_worker, range(remaining))
+
+        done = existing
+        for enc_keys, dec_keys in key_sets:
+            enc_writer.writerow(enc_keys)
+            dec_writer.writerow(dec_keys)
+            enc_file.flush()
+            dec_file.flush()
+            done += 1
+            if progress:
+                progress(done, num_sets)
+    finally:
+        if pool:
+            pool.terminate()
+        enc_file.close()
+        dec_file.close()
     
     print(f"Generated {num_sets} key sets and saved to {enc_filename} and {dec_filename}")
 
 if __name__ == "__main__":
-    generate_keys_csv()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate encryption/decryption key CSVs")
+    parser.add_argument("--num-sets", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+    generate_keys_csv(num_sets=args.num_sets, workers=args.workers, resume=args.resume)
\ No newline at end of file
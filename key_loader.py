@@ -2,7 +2,13 @@ import csv
 import base64
 import random
 import os
+import time
+import logging
+import threading
+from collections import OrderedDict
 from Crypto.PublicKey import RSA, ECC
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.Signature import pkcs1_15
 
 def load_keys_from_csv(enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv'):
     encryption_key_sets = []
@@ -35,89 +41,318 @@ def select_random_key_set(encryption_key_sets, decryption_key_sets):
     
     return encryption_key_sets[random_index], decryption_key_sets[random_index], random_index
 
+# Order of the keys in a prepared key set, as returned by prepare_keys
+KEY_NAMES = ('aes', 'des', 'tdes', 'private_rsa', 'public_rsa', 'private_ecc', 'public_ecc')
+# Scheme objects a prepared key set also builds on demand: {name: (key name, constructor)}
+SCHEME_LOADERS = {
+    'public_rsa_oaep': ('public_rsa', PKCS1_OAEP.new),
+    'private_rsa_oaep': ('private_rsa', PKCS1_OAEP.new),
+    'public_rsa_verifier': ('public_rsa', pkcs1_15.new),
+    'private_rsa_signer': ('private_rsa', pkcs1_15.new)
+}
+
+class PreparedKeys:
+    """A key set whose key objects are built on first access.
+
+    `loaders` maps each name in KEY_NAMES to a zero-argument callable. Keys
+    are read by name (keys.private_rsa or keys.get('private_rsa')), so a
+    sequence that never uses ECC never constructs the ECC keys. Iterating or
+    tuple-unpacking materializes every key, in prepare_keys order.
+
+    The RSA cipher and signature schemes in SCHEME_LOADERS (e.g.
+    keys.public_rsa_oaep) are built the same way, once per key set, and
+    are not part of the tuple.
+    """
+
+    def __init__(self, loaders):
+        self._loaders = loaders
+        self._values = {}
+
+    def get(self, name):
+        value = self._values.get(name)
+        if value is None:
+            scheme = SCHEME_LOADERS.get(name)
+            if scheme is not None:
+                key_name, new_scheme = scheme
+                value = new_scheme(self.get(key_name))
+            else:
+                try:
+                    value = self._loaders[name]()
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Error preparing keys: {e}")
+            # Two threads may race to build the same key; keep whichever landed first
+            value = self._values.setdefault(name, value)
+        return value
+
+    def __getattr__(self, name):
+        if name in KEY_NAMES or name in SCHEME_LOADERS:
+            return self.get(name)
+        raise AttributeError(name)
+
+    def materialized(self):
+        """Names of the keys built so far."""
+        return tuple(name for name in KEY_NAMES if name in self._values)
+
+    def __len__(self):
+        return len(KEY_NAMES)
+
+    def __iter__(self):
+        return (self.get(name) for name in KEY_NAMES)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self.get(name) for name in KEY_NAMES[index])
+        return self.get(KEY_NAMES[index])
+
+def _construct_ecc_public(encoded):
+    public_key_ecc_x, public_key_ecc_y = base64.b64decode(encoded).decode().split('|')
+    return ECC.construct(curve='P-256', point_x=int(public_key_ecc_x), point_y=int(public_key_ecc_y))
+
+def prepare_lazy_keys(enc_key_set, dec_key_set):
+    """Return a PreparedKeys over one CSV row pair; nothing is decoded until asked for."""
+    return PreparedKeys({
+        'aes': lambda: base64.b64decode(enc_key_set['aes_key']),
+        'des': lambda: base64.b64decode(enc_key_set['des_key']),
+        'tdes': lambda: base64.b64decode(enc_key_set['tdes_key']),
+        'private_rsa': lambda: RSA.import_key(base64.b64decode(dec_key_set['private_key_rsa'])),
+        'public_rsa': lambda: RSA.import_key(base64.b64decode(enc_key_set['public_key_rsa'])),
+        'private_ecc': lambda: ECC.construct(
+            curve='P-256', d=int(base64.b64decode(dec_key_set['private_key_ecc']).decode())),
+        'public_ecc': lambda: _construct_ecc_public(enc_key_set['public_key_ecc'])
+    })
+
 def prepare_keys(enc_key_set, dec_key_set):
-    try:
-        # Decode base64 keys
-        key_aes = base64.b64decode(enc_key_set['aes_key'])
-        key_des = base64.b64decode(enc_key_set['des_key'])
-        key_tdes = base64.b64decode(enc_key_set['tdes_key'])
-        
-        # Import RSA keys
-        private_key_rsa_data = base64.b64decode(dec_key_set['private_key_rsa'])
-        private_key_rsa = RSA.import_key(private_key_rsa_data)
-        
-        public_key_rsa_data = base64.b64decode(enc_key_set['public_key_rsa'])
-        public_key_rsa = RSA.import_key(public_key_rsa_data)
-        
-        # Import ECC keys
-        private_key_ecc_d = int(base64.b64decode(dec_key_set['private_key_ecc']).decode())
-        
-        public_key_ecc_data = base64.b64decode(enc_key_set['public_key_ecc']).decode().split('|')
-        public_key_ecc_x = int(public_key_ecc_data[0])
-        public_key_ecc_y = int(public_key_ecc_data[1])
-        
-        # Construct ECC keys
-        private_key_ecc = ECC.construct(curve='P-256', d=private_key_ecc_d)
-        public_key_ecc = ECC.construct(curve='P-256', point_x=public_key_ecc_x, point_y=public_key_ecc_y)
-    except (ValueError, KeyError, TypeError) as e:
-        raise ValueError(f"Error preparing keys: {e}")
-    
-    return key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc
+    return tuple(prepare_lazy_keys(enc_key_set, dec_key_set))
+
+# The cipher and signature functions accept either an RSA key or a scheme
+# already built for it (the cached ones on PreparedKeys, see SCHEME_LOADERS)
+def get_oaep_cipher(rsa_key):
+    """Return the PKCS1_OAEP cipher for `rsa_key`; a cipher is returned as is."""
+    if isinstance(rsa_key, RSA.RsaKey):
+        return PKCS1_OAEP.new(rsa_key)
+    return rsa_key
+
+def get_pkcs1_15_scheme(rsa_key):
+    """Return the pkcs1_15 signer (private key) or verifier (public key) for `rsa_key`; a scheme is returned as is."""
+    if isinstance(rsa_key, RSA.RsaKey):
+        return pkcs1_15.new(rsa_key)
+    return rsa_key
+
+class KeyStore:
+    """Long-lived view of the key CSVs.
+
+    The files are parsed once on first use and prepared key sets (PreparedKeys,
+    which unpack like the 7-tuple returned by prepare_keys) are kept per index
+    in a bounded LRU. Each key object is built the first time it is read, so
+    repeated lookups skip RSA.import_key and ECC.construct entirely and keys
+    a sequence never uses are never built at all.
+    """
+
+    def __init__(self, enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv', max_cached=64):
+        self.enc_filename = enc_filename
+        self.dec_filename = dec_filename
+        self.max_cached = max_cached
+        self._encryption_key_sets = None
+        self._decryption_key_sets = None
+        self._prepared = OrderedDict()  # {index: prepared key tuple}
+        self._mtimes = None  # st_mtime_ns of the backing files at the last load
+        # True while the files are still being generated (see get_random_keys); only
+        # then can a missing index appear later, and the files are re-checked for it
+        self.growing = False
+        self.grow_check_interval = 1.0
+        self._grow_checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def _files(self):
+        return self.enc_filename, self.dec_filename
+
+    def _file_mtimes(self):
+        try:
+            return tuple(os.stat(filename).st_mtime_ns for filename in self._files())
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """Parse both key files, keeping the prepared keys of rows that did not change.
+
+        Returns {'changed': n, 'added': n, 'removed': n} relative to the previous load.
+        """
+        started = time.perf_counter()
+        mtimes = self._file_mtimes()
+        encryption_key_sets, decryption_key_sets = load_keys_from_csv(self.enc_filename, self.dec_filename)
+
+        old_encryption_key_sets = self._encryption_key_sets or []
+        old_decryption_key_sets = self._decryption_key_sets or []
+        old_count = min(len(old_encryption_key_sets), len(old_decryption_key_sets))
+        count = min(len(encryption_key_sets), len(decryption_key_sets))
+        changed = [
+            index for index in range(min(old_count, count))
+            if encryption_key_sets[index] != old_encryption_key_sets[index]
+            or decryption_key_sets[index] != old_decryption_key_sets[index]
+        ]
+
+        with self._lock:
+            reloading = self._mtimes is not None
+            self._encryption_key_sets = encryption_key_sets
+            self._decryption_key_sets = decryption_key_sets
+            self._mtimes = mtimes
+            self._discard_prepared(changed, count)
+        return self._reloaded(reloading, started, len(changed), count - old_count)
+
+    def _discard_prepared(self, changed, count):
+        # Called with the lock held
+        for index in changed:
+            self._prepared.pop(index, None)
+        for index in [index for index in self._prepared if index >= count]:
+            del self._prepared[index]
+
+    def _reloaded(self, reloading, started, changed, count_delta):
+        stats = {'changed': changed, 'added': max(count_delta, 0), 'removed': max(-count_delta, 0)}
+        if reloading:
+            logging.info(
+                f"Reloaded {', '.join(self._files())}: {stats['changed']} changed, {stats['added']} added, "
+                f"{stats['removed']} removed in {(time.perf_counter() - started) * 1000:.1f} ms"
+            )
+        return stats
+
+    def reload_if_changed(self):
+        """Reload if the backing files changed since the last load; returns the load() stats or None."""
+        if self._mtimes is None:
+            return None  # never loaded; the first lookup will load it
+        mtimes = self._file_mtimes()
+        if mtimes is None or mtimes == self._mtimes:
+            return None
+        return self.load()
+
+    def _ensure_loaded(self):
+        if self._encryption_key_sets is None:
+            with self._lock:
+                if self._encryption_key_sets is None:
+                    self.load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return min(len(self._encryption_key_sets), len(self._decryption_key_sets))
+
+    def get_key_sets(self, index):
+        """Return the raw (enc_key_set, dec_key_set) rows at `index`."""
+        self._ensure_loaded()
+        if self.growing and index >= len(self):
+            now = time.monotonic()
+            if now - self._grow_checked_at >= self.grow_check_interval:
+                self._grow_checked_at = now
+                self.reload_if_changed()
+        if index < 0 or index >= len(self):
+            raise IndexError("Index out of range")
+        return self._encryption_key_sets[index], self._decryption_key_sets[index]
+
+    def get_keys(self, index):
+        """Return the PreparedKeys at `index`, creating it on a cache miss."""
+        with self._lock:
+            keys = self._prepared.get(index)
+            if keys is not None:
+                self._prepared.move_to_end(index)
+                return keys
+
+        keys = self._prepare_index(index)
+
+        with self._lock:
+            self._prepared[index] = keys
+            self._prepared.move_to_end(index)
+            while len(self._prepared) > self.max_cached:
+                self._prepared.popitem(last=False)
+        return keys
+
+    def _prepare_index(self, index):
+        enc_key_set, dec_key_set = self.get_key_sets(index)
+        return prepare_lazy_keys(enc_key_set, dec_key_set)
+
+    def select_random_index(self):
+        """Pick a random key index that exists in both files."""
+        count = len(self)
+        if not count:
+            raise ValueError("No key sets available")
+        return random.randint(0, count - 1)
+
+
+BINARY_KEY_STORE = 'key_store.bin'
+
+_key_stores = {}
+_key_stores_lock = threading.Lock()
+
+def get_key_store(enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv',
+                  binary_filename=BINARY_KEY_STORE):
+    """Return the process-wide key store.
+
+    If `binary_filename` exists (see binary_key_store.convert_csv_to_binary)
+    it is used instead of the CSV pair.
+    """
+    if binary_filename and os.path.exists(binary_filename):
+        key = (os.path.abspath(binary_filename),)
+    else:
+        binary_filename = None
+        key = (os.path.abspath(enc_filename), os.path.abspath(dec_filename))
+    with _key_stores_lock:
+        store = _key_stores.get(key)
+        if store is None:
+            if binary_filename:
+                from binary_key_store import BinaryKeyStore
+                store = BinaryKeyStore(binary_filename)
+            else:
+                store = KeyStore(enc_filename, dec_filename)
+            _key_stores[key] = store
+        return store
 
 def get_random_keys():
     enc_filename = 'encryption_keys.csv'
     dec_filename = 'decryption_keys.csv'
     
-    if not os.path.exists(enc_filename) or not os.path.exists(dec_filename):
-        print(f"Keys files not found. Generating new keys...")
+    csv_missing = not os.path.exists(enc_filename) or not os.path.exists(dec_filename)
+    if csv_missing and not os.path.exists(BINARY_KEY_STORE):
+        print(f"Keys files not found. Generating new keys in the background...")
         from generate_keys import generate_keys_csv
-        generate_keys_csv(num_sets=20, enc_filename=enc_filename, dec_filename=dec_filename)
+        
+        # Only wait for the first complete key set; the rest keep streaming in
+        store = get_key_store(enc_filename, dec_filename, binary_filename=None)
+        store.growing = True
+        first_set_ready = threading.Event()
+        errors = []
+
+        def generate():
+            try:
+                generate_keys_csv(
+                    num_sets=20,
+                    enc_filename=enc_filename,
+                    dec_filename=dec_filename,
+                    progress=lambda done, total: first_set_ready.set()
+                )
+                store.reload_if_changed()
+            except Exception as e:
+                errors.append(e)
+                logging.error(f"Key generation failed: {e}")
+            finally:
+                store.growing = False
+                first_set_ready.set()
+
+        threading.Thread(target=generate, daemon=True).start()
+        first_set_ready.wait()
+        if errors:
+            raise errors[0]
     
-    encryption_key_sets, decryption_key_sets = load_keys_from_csv(enc_filename, dec_filename)
-    print(f"Loaded {len(encryption_key_sets)} encryption key sets and {len(decryption_key_sets)} decryption key sets")
+    # Indices come from the current key generation (see key_rotation)
+    from key_rotation import get_key_ring
+    key_store = get_key_ring(enc_filename=enc_filename, dec_filename=dec_filename)
+    print(f"Loaded {len(key_store)} key sets")
     
-    enc_key_set, dec_key_set, random_index = select_random_key_set(encryption_key_sets, decryption_key_sets)
+    random_index = key_store.select_random_index()
     print(f"\nRandomly selected key set")
     
-    keys = prepare_keys(enc_key_set, dec_key_set)
-    return keys + (random_index,)
+    keys = key_store.get_keys(random_index)
+    return tuple(keys) + (random_index,)
 
 def get_keys_by_index(index, enc_filename='encryption_keys.csv', dec_filename='decryption_keys.csv'):
-    encryption_key_sets, decryption_key_sets = load_keys_from_csv(enc_filename, dec_filename)
-    
-    if index < 0 or index >= len(encryption_key_sets) or index >= len(decryption_key_sets):
-        raise IndexError("Index out of range")
-    
-    enc_key_set = encryption_key_sets[index]
-    dec_key_set = decryption_key_sets[index]
-    
-    try:
-        # Decode base64 keys
-        key_aes = base64.b64decode(enc_key_set['aes_key'])
-        key_des = base64.b64decode(enc_key_set['des_key'])
-        key_tdes = base64.b64decode(enc_key_set['tdes_key'])
-        
-        # Import RSA keys
-        private_key_rsa_data = base64.b64decode(dec_key_set['private_key_rsa'])
-        private_key_rsa = RSA.import_key(private_key_rsa_data)
-        
-        public_key_rsa_data = base64.b64decode(enc_key_set['public_key_rsa'])
-        public_key_rsa = RSA.import_key(public_key_rsa_data)
-        
-        # Import ECC keys
-        private_key_ecc_d = int(base64.b64decode(dec_key_set['private_key_ecc']).decode())
-        
-        public_key_ecc_data = base64.b64decode(enc_key_set['public_key_ecc']).decode().split('|')
-        public_key_ecc_x = int(public_key_ecc_data[0])
-        public_key_ecc_y = int(public_key_ecc_data[1])
-        
-        # Construct ECC keys
-        private_key_ecc = ECC.construct(curve='P-256', d=private_key_ecc_d)
-        public_key_ecc = ECC.construct(curve='P-256', point_x=public_key_ecc_x, point_y=public_key_ecc_y)
-    except (ValueError, KeyError, TypeError) as e:
-        raise ValueError(f"Error preparing keys: {e}")
-    
-    return key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc
+    """Return the PreparedKeys at `index`, served from the shared KeyStore."""
+    return get_key_store(enc_filename, dec_filename).get_keys(index)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from key_loader import KeyStore, get_key_store
+from generate_keys import generate_keys_csv
+
+KEY_GENERATIONS_FILE = 'key_generations.json'
+# Wire indices are generation * GENERATION_STRIDE + row, so generation 0
+# indices are the plain row numbers of the original key files.
+GENERATION_STRIDE = 1000000
+
+def make_index(generation, row):
+    return generation * GENERATION_STRIDE + row
+
+def split_index(index):
+    """Return (generation, row) for a wire key index."""
+    return divmod(index, GENERATION_STRIDE)
+
+def prewarm(store):
+    """Import every key of every set in `store` (up to its cache size) so the first lookups do no key parsing."""
+    for index in range(min(len(store), store.max_cached)):
+        tuple(store.get_keys(index))
+
+class KeyRing:
+    """The key generations currently accepted, as published in the manifest.
+
+    Has the same get_keys / select_random_index / __len__ interface as
+    KeyStore, but indices carry their generation. A generation that has been
+    superseded is still accepted until its `retire_at` time, so peers that
+    have not switched yet keep working during the grace window. Without a
+    manifest this is just generation 0, i.e. the plain key files.
+
+    Whenever a manifest change makes a new generation current, its keys
+    are pre-warmed on a background thread (reload_if_changed(), run by a
+    TableWatcher, also pre-warms on the watcher's thread), so lookups never
+    parse the keys of a freshly rotated generation on the request path.
+    """
+
+    def __init__(self, manifest_file=KEY_GENERATIONS_FILE, enc_filename='encryption_keys.csv',
+                 dec_filename='decryption_keys.csv', check_interval=1.0):
+        self.manifest_file = manifest_file
+        self.enc_filename = enc_filename
+        self.dec_filename = dec_filename
+        self.check_interval = check_interval
+        self.current_generation = 0
+        self._generations = {0: (enc_filename, dec_filename, None)}  # {generation: (enc, dec, retire_at)}
+        self._stores = {}  # {generation: KeyStore}
+        self._warmed = set()  # Generations whose keys have been pre-warmed
+        self._mtime_ns = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Re-read the manifest, dropping stores of generations it no longer lists."""
+        mtime_ns = os.stat(self.manifest_file).st_mtime_ns
+        with open(self.manifest_file, 'r') as file:
+            manifest = json.load(file)
+
+        generations = {
+            int(generation): (entry['enc_filename'], entry['dec_filename'], entry.get('retire_at'))
+            for generation, entry in manifest['generations'].items()
+        }
+        with self._lock:
+            self._generations = generations
+            self.current_generation = manifest['current']
+            self._mtime_ns = mtime_ns
+            for generation in list(self._stores):
+                if generation not in generations:
+                    del self._stores[generation]
+
+    def _refresh(self, prewarm_in_background=True):
+        # Stat the manifest at most once per check_interval
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime_ns = os.stat(self.manifest_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self.load()
+            if prewarm_in_background:
+                self._prewarm_in_background()
+
+    def _prewarm_in_background(self):
+        with self._lock:
+            if self.current_generation in self._warmed:
+                return
+        threading.Thread(target=self._prewarm, name='key-prewarm', daemon=True).start()
+
+    def _prewarm(self):
+        try:
+            if self.prewarm_current():
+                logging.info(f"Pre-warmed key generation {self.current_generation}")
+        except Exception as e:
+            logging.error(f"Pre-warming key generation {self.current_generation} failed: {e}")
+
+    def generations(self):
+        """Return {generation: (enc_filename, dec_filename, retire_at)}."""
+        self._refresh()
+        with self._lock:
+            return dict(self._generations)
+
+    def install(self, generation, store):
+        """Use an already prepared store for `generation` instead of loading its files."""
+        with self._lock:
+            self._stores[generation] = store
+            self._warmed.add(generation)
+
+    def prewarm_current(self):
+        """Pre-warm the current generation unless that was already done; returns True if it ran."""
+        self._refresh()
+        with self._lock:
+            generation = self.current_generation
+            if generation in self._warmed:
+                return False
+            self._warmed.add(generation)
+        prewarm(self._store(generation))
+        return True
+
+    def _store(self, generation):
+        with self._lock:
+            store = self._stores.get(generation)
+            if store is None:
+                enc_filename, dec_filename, _ = self._generations[generation]
+                if generation == 0:
+                    store = get_key_store(enc_filename, dec_filename)
+                else:
+                    store = KeyStore(enc_filename, dec_filename)
+                self._stores[generation] = store
+            return store
+
+    def get_keys(self, index):
+        """Return the PreparedKeys for a wire index; raises IndexError for unknown or retired generations."""
+        self._refresh()
+        generation, row = split_index(index)
+        with self._lock:
+            entry = self._generations.get(generation)
+        if entry is None:
+            raise IndexError(f"Unknown key generation {generation}")
+        retire_at = entry[2]
+        if retire_at is not None and time.time() > retire_at:
+            raise IndexError(f"Key generation {generation} has been retired")
+        return self._store(generation).get_keys(row)
+
+    def select_random_index(self):
+        """Pick a random wire index from the current generation."""
+        self._refresh()
+        generation = self.current_generation
+        return make_index(generation, self._store(generation).select_random_index())
+
+    def is_current(self, index):
+        """True if `index` belongs to the current generation."""
+        self._refresh()
+        return split_index(index)[0] == self.current_generation
+
+    def __len__(self):
+        self._refresh()
+        return len(self._store(self.current_generation))
+
+    def reload_if_changed(self):
+        """Pick up manifest changes and reload any loaded generation whose files changed.
+
+        Returns the summed load() stats, or None if nothing changed.
+        """
+        self._checked_at = 0.0
+        self._refresh(prewarm_in_background=False)
+        with self._lock:
+            stores = list(self._stores.values())
+        total = None
+        for store in stores:
+            stats = store.reload_if_changed()
+            if stats:
+                total = total or {'changed': 0, 'added': 0, 'removed': 0}
+                for name, count in stats.items():
+                    total[name] += count
+        self._prewarm()
+        return total
+
+_key_rings = {}
+_key_rings_lock = threading.Lock()
+
+def get_key_ring(manifest_file=KEY_GENERATIONS_FILE, enc_filename='encryption_keys.csv',
+                 dec_filename='decryption_keys.csv'):
+    """Return the process-wide KeyRing for the given manifest."""
+    key = os.path.abspath(manifest_file)
+    with _key_rings_lock:
+        ring = _key_rings.get(key)
+        if ring is None:
+            ring = KeyRing(manifest_file, enc_filename, dec_filename)
+            _key_rings[key] = ring
+        return ring
+
+class KeyRotationService:
+    """Generates, pre-warms and publishes new key generations for a KeyRing.
+
+    rotate() generates the next generation's key files, prepares every key
+    set in memory, and only then rewrites the manifest (atomically, via
+    os.replace). The previous generation is given `grace_period` seconds
+    before it is retired. Run it in one process, normally the commander
+    server; every other process follows the manifest through its KeyRing.
+    """
+
+    def __init__(self, key_ring, num_sets=20, grace_period=300.0, interval=None, workers=None):
+        self.key_ring = key_ring
+        self.num_sets = num_sets
+        self.grace_period = grace_period
+        self.interval = interval
+        self.workers = workers
+        self._rotate_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _generation_filenames(self, generation):
+        directory = os.path.dirname(self.key_ring.manifest_file)
+        return (
+            os.path.join(directory, f'encryption_keys.gen{generation}.csv'),
+            os.path.join(directory, f'decryption_keys.gen{generation}.csv')
+        )
+
+    def rotate(self):
+        """Generate, pre-warm and publish the next generation; returns its number."""
+        with self._rotate_lock:
+            started = time.perf_counter()
+            generations = self.key_ring.generations()
+            generation = max(generations) + 1
+            enc_filename, dec_filename = self._generation_filenames(generation)
+
+            generate_keys_csv(self.num_sets, enc_filename + '.tmp', dec_filename + '.tmp',
+                              workers=self.workers, progress=None)
+            os.replace(enc_filename + '.tmp', enc_filename)
+            os.replace(dec_filename + '.tmp', dec_filename)
+
+            store = KeyStore(enc_filename, dec_filename, max_cached=self.num_sets)
+            prewarm(store)
+            self.key_ring.install(generation, store)
+
+            now = time.time()
+            published = {}
+            retired = []
+            for old_generation, (old_enc, old_dec, retire_at) in generations.items():
+                if retire_at is None:
+                    retire_at = now + self.grace_period
+                elif retire_at < now:
+                    retired.append((old_generation, old_enc, old_dec))
+                    continue
+                published[str(old_generation)] = {
+                    'enc_filename': old_enc, 'dec_filename': old_dec, 'retire_at': retire_at
+                }
+            published[str(generation)] = {
+                'enc_filename': enc_filename, 'dec_filename': dec_filename, 'retire_at': None
+            }
+
+            manifest_tmp = self.key_ring.manifest_file + '.tmp'
+            with open(manifest_tmp, 'w') as file:
+                json.dump({'current': generation, 'generations': published}, file, indent=2)
+            os.replace(manifest_tmp, self.key_ring.manifest_file)
+            self.key_ring.load()
+
+            # Generation 0 is the original key files, which are never deleted
+            for old_generation, old_enc, old_dec in retired:
+                if old_generation:
+                    for filename in (old_enc, old_dec):
+                        try:
+                            os.remove(filename)
+                        except FileNotFoundError:
+                            pass
+
+            logging.info(
+                f"Published key generation {generation} ({len(store)} sets, "
+                f"{time.perf_counter() - started:.1f}s); retired {len(retired)}"
+            )
+            return generation
+
+    def start(self):
+        """Rotate every `interval` seconds in a background thread."""
+        if self.interval and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.rotate()
+            except Exception as e:
+                logging.error(f"Key rotation failed: {e}")
@@ -0,0 +1,170 @@
+import json
+import base64
+import struct
+
+# Version 1 of the binary location/chat payload. Layout, little-endian:
+#   header    version u8, type u8, flags u8, layer count u8,
+#             iv bitmap u8, tag bitmap u8, key index u64
+#   sequence  id u16 if FLAG_SEQUENCE_ID, else the raw 32-byte hash
+#   counter   session message counter u64 if FLAG_COUNTER
+#   fields    each present iv, then each present tag (u16 length + bytes),
+#             data (u32 length + bytes), signature (u16 length + bytes),
+#             sender (u8 length + UTF-8) if FLAG_SENDER
+# Bit i of a bitmap is set when layer i has an iv/tag. A JSON payload always
+# starts with "{", which is never a valid version byte.
+PAYLOAD_CODEC_VERSION = 1
+
+HEADER = struct.Struct('<BBBBBBQ')
+SEQUENCE_ID = struct.Struct('<H')
+SEQUENCE_HASH_SIZE = 32
+COUNTER = struct.Struct('<Q')
+SHORT_LENGTH = struct.Struct('<H')
+LONG_LENGTH = struct.Struct('<I')
+SENDER_LENGTH = struct.Struct('<B')
+
+PAYLOAD_TYPES = ('location', 'chat')
+FLAG_SESSION = 0x01
+FLAG_SEQUENCE_ID = 0x02
+FLAG_SENDER = 0x04
+FLAG_COUNTER = 0x08
+MAX_LAYERS = 8
+
+def _raw(value):
+    """Raw bytes of a payload field, base64-decoding JSON-style strings."""
+    return base64.b64decode(value) if isinstance(value, str) else bytes(value)
+
+def _pack_field(parts, length_struct, value):
+    parts.append(length_struct.pack(len(value)))
+    parts.append(value)
+
+def encode_binary_payload(payload):
+    """Pack a "binary" format location/chat payload; raises ValueError if it cannot be.
+
+    That includes fields too large for their length prefix or header slot,
+    such as a sender name over 255 bytes or a sequence ID over 65535.
+    """
+    try:
+        return _pack_binary_payload(payload)
+    except struct.error as e:
+        raise ValueError(f"Payload does not fit the binary encoding: {e}")
+
+def _pack_binary_payload(payload):
+    if payload.get("format") != "binary":
+        raise ValueError("Only binary format payloads have a binary encoding")
+    ivs = payload["ivs"]
+    tags = payload["tags"] or [None] * len(ivs)
+    if len(ivs) > MAX_LAYERS or len(tags) != len(ivs):
+        raise ValueError(f"Unsupported layer count: {len(ivs)}")
+
+    flags = FLAG_SESSION if payload.get("session") else 0
+    if "sequence_id" in payload:
+        flags |= FLAG_SEQUENCE_ID
+        sequence = SEQUENCE_ID.pack(payload["sequence_id"])
+    else:
+        sequence = bytes.fromhex(payload["sequence_hash"])
+        if len(sequence) != SEQUENCE_HASH_SIZE:
+            raise ValueError("Sequence hash must be 32 bytes")
+    if "counter" in payload:
+        flags |= FLAG_COUNTER
+        sequence += COUNTER.pack(payload["counter"])
+    sender = payload.get("sender")
+    if sender is not None:
+        flags |= FLAG_SENDER
+
+    iv_bitmap = tag_bitmap = 0
+    for layer, (iv, tag) in enumerate(zip(ivs, tags)):
+        if iv is not None:
+            iv_bitmap |= 1 << layer
+        if tag is not None:
+            tag_bitmap |= 1 << layer
+
+    parts = [
+        HEADER.pack(PAYLOAD_CODEC_VERSION, PAYLOAD_TYPES.index(payload["type"]), flags, len(ivs),
+                    iv_bitmap, tag_bitmap, payload["random_index"]),
+        sequence
+    ]
+    for value in list(ivs) + list(tags):
+        if value is not None:
+            _pack_field(parts, SHORT_LENGTH, _raw(value))
+    _pack_field(parts, LONG_LENGTH, _raw(payload["data"]))
+    _pack_field(parts, SHORT_LENGTH, _raw(payload["signature"]))
+    if sender is not None:
+        _pack_field(parts, SENDER_LENGTH, sender.encode())
+    return b"".join(parts)
+
+def decode_binary_payload(frame):
+    """Unpack a binary payload into the dict a JSON payload decodes to.
+
+    ivs, tags, data and signature come back as raw bytes rather than
+    base64 strings; decode_wire and the signature checks accept both. The
+    fields are copied out of `frame`, so the result outlives it.
+    """
+    view = memoryview(frame)
+    try:
+        version, type_index, flags, layers, iv_bitmap, tag_bitmap, random_index = HEADER.unpack_from(view)
+        if version != PAYLOAD_CODEC_VERSION:
+            raise ValueError(f"Unsupported payload version: {version}")
+        offset = HEADER.size
+
+        payload = {
+            "type": PAYLOAD_TYPES[type_index],
+            "format": "binary",
+            "session": bool(flags & FLAG_SESSION),
+            "random_index": random_index
+        }
+        if flags & FLAG_SEQUENCE_ID:
+            payload["sequence_id"] = SEQUENCE_ID.unpack_from(view, offset)[0]
+            offset += SEQUENCE_ID.size
+        else:
+            payload["sequence_hash"] = view[offset:offset + SEQUENCE_HASH_SIZE].hex()
+            offset += SEQUENCE_HASH_SIZE
+        if flags & FLAG_COUNTER:
+            payload["counter"] = COUNTER.unpack_from(view, offset)[0]
+            offset += COUNTER.size
+
+        ivs = [None] * layers
+        tags = [None] * layers
+        fields = []
+        for layer in range(layers):
+            if iv_bitmap >> layer & 1:
+                fields.append((ivs, layer, SHORT_LENGTH))
+        for layer in range(layers):
+            if tag_bitmap >> layer & 1:
+                fields.append((tags, layer, SHORT_LENGTH))
+        fields.append((payload, "data", LONG_LENGTH))
+        fields.append((payload, "signature", SHORT_LENGTH))
+        if flags & FLAG_SENDER:
+            fields.append((payload, "sender", SENDER_LENGTH))
+
+        for target, key, length_struct in fields:
+            start = offset + length_struct.size
+            offset = start + length_struct.unpack_from(view, offset)[0]
+            if offset > len(view):
+                raise ValueError("Truncated payload")
+            target[key] = view[start:offset].tobytes()
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"Malformed payload: {e}")
+
+    payload["ivs"] = ivs
+    payload["tags"] = tags
+    if "sender" in payload:
+        payload["sender"] = payload["sender"].decode()
+    return payload
+
+def is_binary_payload(frame):
+    return len(frame) > 0 and frame[0] == PAYLOAD_CODEC_VERSION
+
+def encode_payload(payload, binary=False):
+    """Encode a payload for the wire: the binary codec if negotiated and possible, else JSON."""
+    if binary and payload.get("format") == "binary":
+        try:
+            return encode_binary_payload(payload)
+        except ValueError:
+            pass  # Decoders accept both, so JSON carries whatever the binary layout cannot
+    return json.dumps(payload)
+
+def decode_payload(frame):
+    """Decode a JSON or binary payload frame (bytes or memoryview)."""
+    if is_binary_payload(frame):
+        return decode_binary_payload(frame)
+    return json.loads(bytes(frame))
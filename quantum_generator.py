@@ -1,45 +1,184 @@
-import csv
+import time
+import secrets
+import threading
 import numpy as np
 import pennylane as qml
+from refill_pool import RefillPool
+from sequence_utils import get_sequence_registry
+from sequence_costs import get_sequence_costs
+
+DEFAULT_BATCH_SIZE = 4096
+
+class QuantumIndexSampler:
+    """Batched quantum sampler for a fixed number of selector qubits.
+
+    The device and QNode are built once and every circuit execution draws
+    `batch_size` shots. Measured values are handed out one at a time from a
+    buffer that is refilled when it runs dry.
+    """
+
+    def __init__(self, num_qubits, batch_size=DEFAULT_BATCH_SIZE):
+        self.num_qubits = num_qubits
+        self.batch_size = batch_size
+        self._weights = 1 << np.arange(num_qubits - 1, -1, -1)  # MSB first, like the bit string
+        self._buffer = []
+        self._lock = threading.Lock()
+        self.samples_drawn = 0
+        self.sampling_time = 0.0
+
+        dev = qml.device("default.qubit", wires=num_qubits)
+
+        @qml.set_shots(batch_size)
+        @qml.qnode(dev)
+        def quantum_index_selector():
+            """Quantum circuit for selecting a random index"""
+            for i in range(num_qubits):
+                qml.Hadamard(wires=i)  # Equal superposition of all indices
+            return qml.sample(wires=range(num_qubits))
+
+        self._circuit = quantum_index_selector
+
+    def _refill(self):
+        start = time.perf_counter()
+        bits = np.asarray(self._circuit()).reshape(-1, self.num_qubits)
+        values = (bits @ self._weights).tolist()
+        self.sampling_time += time.perf_counter() - start
+        self.samples_drawn += len(values)
+        self._buffer = values
+
+    def next_value(self):
+        """Return one measured value in [0, 2**num_qubits)."""
+        with self._lock:
+            if not self._buffer:
+                self._refill()
+            return self._buffer.pop()
+
+    def next_index(self, num_keys):
+        """Return a uniformly distributed index in [0, num_keys).
+
+        Measured values are concatenated until they cover num_keys, and a
+        value at or above the largest multiple of num_keys that fits in
+        those bits is discarded and drawn again, so no index is favoured.
+        """
+        draws = -(-num_selector_qubits(num_keys) // self.num_qubits)  # ceiling division
+        limit = num_keys * ((1 << draws * self.num_qubits) // num_keys)
+        while True:
+            value = 0
+            for _ in range(draws):
+                value = (value << self.num_qubits) | self.next_value()
+            if value < limit:
+                return value % num_keys
+
+    @property
+    def buffered(self):
+        return len(self._buffer)
+
+    @property
+    def samples_per_second(self):
+        """Samples produced per second of circuit execution time."""
+        if not self.sampling_time:
+            return 0.0
+        return self.samples_drawn / self.sampling_time
+
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+def num_selector_qubits(num_keys):
+    """Number of qubits needed to index `num_keys` entries."""
+    return max(1, int(np.ceil(np.log2(num_keys))))
+
+def get_quantum_sampler(num_keys, batch_size=DEFAULT_BATCH_SIZE):
+    """Return the shared sampler for the qubit count needed by `num_keys`."""
+    num_qubits = num_selector_qubits(num_keys)
+    with _samplers_lock:
+        sampler = _samplers.get(num_qubits)
+        if sampler is None:
+            sampler = QuantumIndexSampler(num_qubits, batch_size)
+            _samplers[num_qubits] = sampler
+        return sampler
 
 def quantum_random_selector(num_keys):
     """Quantum-based random selection of a key index."""
-    num_selector_qubits = int(np.ceil(np.log2(num_keys)))  # Number of qubits needed to index keys
-    dev = qml.device("default.qubit", wires=num_selector_qubits, shots=1)
+    return get_quantum_sampler(num_keys).next_index(num_keys)
+
+class EntropyPool(RefillPool):
+    """Background reservoir of pre-drawn quantum indices in [0, num_keys).
+
+    See refill_pool.RefillPool for the refill thread and watermarks. When
+    the reservoir is empty take() returns `fallback(num_keys)` instead (by
+    default secrets.randbelow, which reads os.urandom). Pass fallback=None
+    to raise IndexError on a miss.
+    """
+
+    thread_name = 'entropy-pool'
+
+    def __init__(self, num_keys, low_watermark=256, high_watermark=4096,
+                 fallback=secrets.randbelow, sampler=None):
+        super().__init__(low_watermark, high_watermark)
+        self.num_keys = num_keys
+        self.fallback = fallback
+        self.sampler = sampler or get_quantum_sampler(num_keys)
+
+    def produce(self):
+        return self.sampler.next_index(self.num_keys)
 
-    @qml.qnode(dev)
-    def quantum_index_selector():
-        """Quantum circuit for selecting a random index"""
-        for i in range(num_selector_qubits):
-            qml.Hadamard(wires=i)  # Equal superposition of all indices
-        return qml.sample(wires=range(num_selector_qubits))
+    def miss(self):
+        if self.fallback is None:
+            raise IndexError("Entropy pool is empty")
+        return self.fallback(self.num_keys)
 
-    # Measure and get index
-    binary_index = ''.join(map(str, quantum_index_selector()))
-    selected_index = int(binary_index, 2) % num_keys  # Convert to decimal and wrap around
-    return selected_index
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_entropy_pool(num_keys):
+    """Return the shared, running entropy pool for `num_keys` entries."""
+    with _pools_lock:
+        pool = _pools.get(num_keys)
+        if pool is None:
+            pool = EntropyPool(num_keys)
+            pool.start()
+            _pools[num_keys] = pool
+        return pool
 
 def get_random_sequence_from_csv(csv_file='sequence.csv'):
     """Get a quantum-randomly selected encryption sequence from the CSV file."""
-    sequences = []
-    
-    with open(csv_file, 'r', newline='') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header row
-        for row in reader:
-            if len(row) >= 2:  # Ensure row has sequence and hash
-                sequence = row[0].strip('"')  # Remove quotes
-                hash_value = row[1]
-                sequences.append((sequence, hash_value))
-    
-    if not sequences:
-        raise ValueError("No sequences found in the CSV file")
-    
-    # Select a sequence using quantum randomness
-    selected_index = quantum_random_selector(len(sequences))
-    sequence_str, hash_value = sequences[selected_index]
+    _, methods, hash_value = get_random_sequence_entry(csv_file)
+    return methods, hash_value
+
+def get_random_sequence_entry(csv_file=None, max_cost_us=None, max_bytes=None, data_size=32,
+                              session=False, wait=True):
+    """Return (sequence_id, methods, hash) for a quantum-randomly selected sequence.
+
+    The default (None) selects from the computed sequence space. With
+    `max_cost_us` and/or `max_bytes` the choice is restricted to sequences
+    whose calibrated cost and estimated wire size for a `data_size`-byte
+    message fit the budget (see sequence_costs); `session` picks the costs
+    under a session key. With wait=False the budget only applies once the
+    costs are loaded: until then they are loaded in the background and any
+    sequence may be selected.
+    """
+    registry = get_sequence_registry(csv_file)
+    budgeted = max_cost_us is not None or max_bytes is not None
+    if budgeted and not wait and not get_sequence_costs().loaded:
+        get_sequence_costs().load_in_background(csv_file)
+        budgeted = False
     
-    # Convert the sequence string to a list of methods
-    methods = [method.strip() for method in sequence_str.split(',')]
+    if not budgeted:
+        num_sequences = len(registry)
+        if not num_sequences:
+            raise ValueError("No sequences found in the CSV file")
+        
+        # Select a sequence using pre-drawn quantum randomness
+        selected_index = get_entropy_pool(num_sequences).take()
+    else:
+        eligible = get_sequence_costs().eligible(csv_file, max_cost_us, max_bytes, data_size, session)
+        if not eligible:
+            raise ValueError(f"No sequence fits the budget (max_cost_us={max_cost_us}, max_bytes={max_bytes})")
+        selected_index = eligible[get_entropy_pool(len(eligible)).take()]
+    methods, hash_value = registry.get(selected_index)
     
-    return methods, hash_value
\ No newline at end of file
+    return selected_index, methods, hash_value
+
+def get_random_sequence():
+    """Get a quantum-randomly selected sequence from the full computed sequence space."""
+    return get_random_sequence_from_csv(None)
\ No newline at end of file
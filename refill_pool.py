@@ -0,0 +1,95 @@
+import time
+import logging
+import threading
+from collections import deque
+
+class RefillPool:
+    """Reservoir of pre-made items topped up by a background thread.
+
+    A daemon thread calls produce() until the reservoir holds
+    `high_watermark` items whenever it drops below `low_watermark`. take()
+    never waits for that thread: every item is handed out exactly once, and
+    when the reservoir is empty it counts a miss and returns miss() instead.
+    Subclasses implement produce() and may override miss() (which by
+    default produces an item inline).
+    """
+
+    thread_name = 'refill-pool'
+
+    def __init__(self, low_watermark, high_watermark):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError("low_watermark must be below high_watermark")
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self._items = deque(maxlen=high_watermark)
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_time = 0.0
+
+    def produce(self):
+        raise NotImplementedError
+
+    def miss(self):
+        return self.produce()
+
+    def start(self):
+        """Start the refill thread and request an initial fill."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        self._wakeup.set()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._running:
+                break
+            try:
+                self._fill()
+            except Exception as e:
+                logging.error(f"Refill of {type(self).__name__} failed: {e}")
+
+    def _fill(self):
+        start = time.perf_counter()
+        while self._running and len(self._items) < self.high_watermark:
+            self._items.append(self.produce())
+        self.refill_time += time.perf_counter() - start
+        self.refills += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def take(self):
+        """Return a pre-made item without blocking."""
+        try:
+            item = self._items.popleft()
+            self.hits += 1
+        except IndexError:
+            self.misses += 1
+            item = self.miss()
+        if len(self._items) < self.low_watermark:
+            self._wakeup.set()
+        return item
+
+    def stats(self):
+        return {
+            'depth': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refills': self.refills,
+            'refill_time': self.refill_time,
+        }
@@ -0,0 +1,106 @@
+import queue
+import threading
+from collections import deque
+
+# Overflow policies for SendQueue.put()
+BLOCK = 'block'  # Wait for room: chat and handshake frames
+DROP_OLDEST = 'drop-oldest'  # Evict the oldest queued DROP_OLDEST frame: telemetry and cumulative acks
+ALWAYS = 'always'  # Never wait or drop: small control frames written from an event loop
+
+class SendQueue:
+    """Bounded queue of encoded frames waiting to be written to one connection.
+
+    Producers on any thread put() frames; the connection's writer takes
+    everything queued with take_all() and sends it as one write. When
+    `max_frames` are queued, put() applies the frame's overflow policy:
+    BLOCK waits for room (raising queue.Full after `timeout`), DROP_OLDEST
+    evicts the oldest queued DROP_OLDEST frame (or drops the new one if
+    there is none) and ALWAYS enqueues anyway. After close() no new frames
+    are accepted, but the writer can still take the ones already queued.
+    """
+
+    def __init__(self, max_frames=64, max_batch_bytes=256 * 1024, on_put=None):
+        self.max_frames = max_frames
+        self.max_batch_bytes = max_batch_bytes
+        self.on_put = on_put  # Called after every accepted put, e.g. to wake an asyncio writer
+        self._frames = deque()  # (frame, policy)
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._not_empty = threading.Condition(self._lock)
+        self.closed = False
+        self.max_depth = 0
+        self.queued = 0
+        self.dropped = 0
+        self.batches = 0
+        self.batched_frames = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame, policy=BLOCK, timeout=None):
+        """Queue an encoded frame; returns False if it was dropped instead."""
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Connection closed")
+            if len(self._frames) >= self.max_frames:
+                if policy == BLOCK:
+                    if not self._not_full.wait_for(
+                            lambda: self.closed or len(self._frames) < self.max_frames, timeout):
+                        raise queue.Full(f"Send queue full ({self.max_frames} frames)")
+                    if self.closed:
+                        raise ConnectionError("Connection closed")
+                elif policy == DROP_OLDEST:
+                    self.dropped += 1
+                    for index, (_, queued_policy) in enumerate(self._frames):
+                        if queued_policy == DROP_OLDEST:
+                            del self._frames[index]
+                            break
+                    else:
+                        return False
+            self._frames.append((frame, policy))
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(self._frames))
+            self._not_empty.notify()
+        if self.on_put:
+            self.on_put()
+        return True
+
+    def take_all(self, timeout=None):
+        """Remove and return the queued frames, at most `max_batch_bytes` worth (but at least one).
+
+        Waits up to `timeout` seconds for a frame (None waits until one is
+        queued or the queue is closed; 0 does not wait). Returns [] if there
+        is nothing to write.
+        """
+        with self._lock:
+            if timeout != 0:
+                self._not_empty.wait_for(lambda: self._frames or self.closed, timeout)
+            frames = []
+            size = 0
+            while self._frames and (not frames or size + len(self._frames[0][0]) <= self.max_batch_bytes):
+                frame = self._frames.popleft()[0]
+                frames.append(frame)
+                size += len(frame)
+            if frames:
+                self.batches += 1
+                self.batched_frames += len(frames)
+                self._not_full.notify_all()
+            return frames
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+        if self.on_put:
+            self.on_put()
+
+    def stats(self):
+        return {
+            'depth': len(self._frames),
+            'max_depth': self.max_depth,
+            'queued': self.queued,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'frames_per_batch': self.batched_frames / self.batches if self.batches else 0.0
+        }
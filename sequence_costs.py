@@ -0,0 +1,238 @@
+import os
+import csv
+import time
+import logging
+import argparse
+import threading
+
+from Crypto.Random import get_random_bytes
+
+from cipher_plan import compile_plan
+from key_loader import get_key_store
+from payload_codec import encode_binary_payload
+from session_crypto import Session
+from sequence_utils import get_sequence_registry
+
+SEQUENCE_COSTS_FILE = 'sequence_costs.csv'
+# `session` is 1 for the cost under a session key (symmetric layers only), 0 for the full key set
+COSTS_HEADERS = ['sequence_hash', 'session', 'cost_us', 'overhead_bytes', 'expansion']
+# Plaintext sizes the wire size is measured at; both stay under the RSA-OAEP limit
+CALIBRATION_SIZES = (16, 128)
+SESSION_MAC_SIZE = 32  # HMAC-SHA256
+
+def _wire_bytes(wire, signature_size, session):
+    """Size of the binary-codec location payload carrying `wire`."""
+    ivs, encrypted_data, tags = wire
+    payload = {
+        "type": "location",
+        "format": "binary",
+        "session": session,
+        "ivs": ivs,
+        "data": encrypted_data,
+        "tags": tags,
+        "signature": bytes(signature_size),
+        "random_index": 0,
+        "sequence_id": 0
+    }
+    if session:
+        payload["counter"] = 0
+    return len(encode_binary_payload(payload))
+
+def calibrate_sequence(methods, keys, rounds=5, sessions=None):
+    """Measure one sequence: returns (cost_us, overhead_bytes, expansion).
+
+    cost_us is the best-of-`rounds` time to encrypt and decrypt a small
+    message with the full key set, or, given `sessions` (a sending and a
+    receiving Session over one key), with the session's symmetric layers.
+    The wire size of a location payload in the binary codec, signature
+    included, is modelled as overhead_bytes + expansion * plaintext_bytes,
+    fitted at CALIBRATION_SIZES.
+    """
+    key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc = keys
+    if sessions:
+        sending, receiving = sessions
+        encrypt = lambda data: sending.encrypt(data, methods)
+        decrypt = lambda wire: receiving.decrypt(*wire, methods)
+        signature_size = SESSION_MAC_SIZE
+    else:
+        plan = compile_plan(methods)
+        encrypt = lambda data: plan.encrypt(data, key_aes, key_des, key_tdes, public_key_rsa, public_key_ecc,
+                                            binary=True)
+        decrypt = lambda wire: plan.decrypt(*wire, key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc,
+                                            binary=True)
+        signature_size = private_key_rsa.size_in_bytes()
+    small, large = ('x' * size for size in CALIBRATION_SIZES)
+
+    best_ns = None
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        wire = encrypt(small)
+        decrypt(wire)
+        elapsed_ns = time.perf_counter_ns() - started
+        best_ns = elapsed_ns if best_ns is None else min(best_ns, elapsed_ns)
+
+    session = sessions is not None
+    small_bytes = _wire_bytes(wire, signature_size, session)
+    large_bytes = _wire_bytes(encrypt(large), signature_size, session)
+    expansion = (large_bytes - small_bytes) / (CALIBRATION_SIZES[1] - CALIBRATION_SIZES[0])
+    overhead_bytes = small_bytes - expansion * CALIBRATION_SIZES[0]
+    return best_ns / 1000, overhead_bytes, expansion
+
+def calibrate(csv_file=None, out_filename=SEQUENCE_COSTS_FILE, rounds=5, key_index=0):
+    """Calibrate every sequence of a table, with and without a session, and save the results.
+
+    Returns {(hash, session): (cost_us, overhead_bytes, expansion)}.
+    """
+    started = time.perf_counter()
+    registry = get_sequence_registry(csv_file)
+    keys = tuple(get_key_store().get_keys(key_index))
+    session_key = get_random_bytes(32)
+    sessions = (Session(session_key, initiator=True), Session(session_key, initiator=False))
+
+    costs = {}
+    for index in range(len(registry)):
+        methods, sequence_hash = registry.get(index)
+        costs[(sequence_hash, False)] = calibrate_sequence(methods, keys, rounds)
+        costs[(sequence_hash, True)] = calibrate_sequence(methods, keys, rounds, sessions)
+
+    tmp_filename = out_filename + '.tmp'
+    with open(tmp_filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(COSTS_HEADERS)
+        for (sequence_hash, session), (cost_us, overhead_bytes, expansion) in costs.items():
+            writer.writerow([sequence_hash, int(session), f'{cost_us:.1f}', f'{overhead_bytes:.1f}',
+                             f'{expansion:.3f}'])
+    os.replace(tmp_filename, out_filename)
+
+    logging.info(f"Calibrated {len(registry)} sequences in {time.perf_counter() - started:.1f}s")
+    return costs
+
+def load_costs(filename=SEQUENCE_COSTS_FILE):
+    """Read a costs file; returns None if it was written in an older format."""
+    costs = {}
+    with open(filename, 'r', newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        if reader.fieldnames != COSTS_HEADERS:
+            return None
+        for row in reader:
+            costs[(row['sequence_hash'], row['session'] == '1')] = (
+                float(row['cost_us']), float(row['overhead_bytes']), float(row['expansion'])
+            )
+    return costs
+
+class SequenceCosts:
+    """Per-sequence cost annotations and the budget filter built on them.
+
+    Costs are read from `filename`; if it does not exist (or is in an older
+    format) a calibration run is done on first use and saved there.
+    load_in_background() does that on a daemon thread instead, so an
+    interactive caller never waits for it; after a failed background load it
+    is not retried for `retry_interval` seconds. Every sequence has a cost with
+    the full key set and one under a session key (session=True). Eligible
+    index lists are cached per (table, budget, session), so repeated
+    selections with the same budget do no filtering.
+    """
+
+    def __init__(self, filename=SEQUENCE_COSTS_FILE, retry_interval=300.0):
+        self.filename = filename
+        self.retry_interval = retry_interval
+        self._costs = None
+        self._eligible = {}  # {(table fingerprint, max_cost_us, max_bytes, data_size, session): tuple of indices}
+        self._lock = threading.Lock()
+        self._loader = None
+        self._failed_at = None  # monotonic time of the last failed background load
+
+    @property
+    def loaded(self):
+        return self._costs is not None
+
+    def _ensure_loaded(self, csv_file):
+        if self._costs is None:
+            with self._lock:
+                if self._costs is None:
+                    costs = load_costs(self.filename) if os.path.exists(self.filename) else None
+                    if costs is None:
+                        logging.info(f"{self.filename} missing or outdated; calibrating sequence costs")
+                        costs = calibrate(csv_file, self.filename)
+                    self._costs = costs
+
+    def _load(self, csv_file):
+        try:
+            self._ensure_loaded(csv_file)
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            logging.error(f"Loading sequence costs failed: {e}; retrying in {self.retry_interval:.0f}s at the earliest")
+
+    def load_in_background(self, csv_file=None):
+        """Load (or calibrate) the costs on a daemon thread unless that is done, under way or recently failed."""
+        if self._costs is not None or (self._loader is not None and self._loader.is_alive()):
+            return
+        if self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval:
+            return
+        self._loader = threading.Thread(target=self._load, args=(csv_file,), daemon=True)
+        self._loader.start()
+
+    def get(self, sequence_hash, csv_file=None, session=False):
+        """Return (cost_us, overhead_bytes, expansion) for a sequence, or None if it was never calibrated."""
+        self._ensure_loaded(csv_file)
+        return self._costs.get((sequence_hash, session))
+
+    def estimate_bytes(self, sequence_hash, data_size, csv_file=None, session=False):
+        cost = self.get(sequence_hash, csv_file, session)
+        return None if cost is None else cost[1] + cost[2] * data_size
+
+    def eligible(self, csv_file=None, max_cost_us=None, max_bytes=None, data_size=32, session=False):
+        """Return the indices of the sequences within budget, in table order.
+
+        `max_bytes` is checked against the estimated wire size of a
+        `data_size`-byte plaintext. `session` selects the costs under a
+        session key. Uncalibrated sequences are never eligible.
+        """
+        registry = get_sequence_registry(csv_file)
+        key = (registry.fingerprint(), max_cost_us, max_bytes, data_size, session)
+        eligible = self._eligible.get(key)
+        if eligible is not None:
+            return eligible
+
+        self._ensure_loaded(csv_file)
+        indices = []
+        for index in range(len(registry)):
+            cost = self._costs.get((registry.get(index)[1], session))
+            if cost is None:
+                continue
+            cost_us, overhead_bytes, expansion = cost
+            if max_cost_us is not None and cost_us > max_cost_us:
+                continue
+            if max_bytes is not None and overhead_bytes + expansion * data_size > max_bytes:
+                continue
+            indices.append(index)
+
+        eligible = self._eligible[key] = tuple(indices)
+        return eligible
+
+_sequence_costs = {}
+_sequence_costs_lock = threading.Lock()
+
+def get_sequence_costs(filename=SEQUENCE_COSTS_FILE):
+    """Return the process-wide SequenceCosts for `filename`."""
+    key = os.path.abspath(filename)
+    with _sequence_costs_lock:
+        costs = _sequence_costs.get(key)
+        if costs is None:
+            costs = _sequence_costs[key] = SequenceCosts(filename)
+        return costs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-sequence cost and ciphertext expansion")
+    parser.add_argument("--csv-file", default=None, help="sequence CSV (default: the computed sequence space)")
+    parser.add_argument("--out", default=SEQUENCE_COSTS_FILE)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    costs = calibrate(args.csv_file, args.out, args.rounds)
+    for session in (False, True):
+        path_costs = [cost for (_, in_session), cost in costs.items() if in_session == session]
+        print(f"{'Session' if session else 'Full key set'}: {len(path_costs)} sequences, "
+              f"{min(path_costs)[0]:.0f}-{max(path_costs)[0]:.0f} us per encrypt+decrypt")
+    print(f"Saved to {args.out}")
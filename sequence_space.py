@@ -0,0 +1,124 @@
+import math
+import threading
+
+from sequence_utils import generate_hash, table_fingerprint
+
+ALGORITHMS = ('rsa', 'aes', 'des', 'tdes', 'aes-gcm', 'ecc')
+
+class SequenceSpace:
+    """Every RSA-first method ordering, addressed by rank instead of a stored table.
+
+    Rank i is the i-th sequence in the order generate_sequences produces
+    them (by length, then itertools.permutations order), so the first 100
+    ranks are exactly the rows of the default sequence.csv. unrank()/rank()
+    are pure arithmetic; hashes are computed when first asked for and
+    memoized. Offers the same __len__ / get / find_by_hash interface as
+    SequenceRegistry.
+    """
+
+    def __init__(self, algorithms=ALGORITHMS, min_length=2, max_length=6, first='rsa'):
+        self.first = first
+        self.others = tuple(algorithm for algorithm in algorithms if algorithm != first)
+        self._lengths = []  # [(permutation length, first rank, count)]
+        start = 0
+        for length in range(min_length - 1, max_length):  # -1 because `first` is always prepended
+            count = math.perm(len(self.others), length)
+            self._lengths.append((length, start, count))
+            start += count
+        self._size = start
+        self._hashes = {}  # {rank: hash}
+        self._by_hash = {}  # {hash: rank}, complete once _all_hashed is set
+        self._all_hashed = False
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def unrank(self, index):
+        """Return the methods tuple at rank `index`."""
+        if index < 0 or index >= self._size:
+            raise IndexError("Sequence index out of range")
+        for length, start, count in self._lengths:
+            if index < start + count:
+                break
+        rank = index - start
+        pool = list(self.others)
+        methods = [self.first]
+        for position in range(length):
+            block = math.perm(len(pool) - 1, length - position - 1)
+            choice, rank = divmod(rank, block)
+            methods.append(pool.pop(choice))
+        return tuple(methods)
+
+    def rank(self, methods):
+        """Return the rank of a methods tuple; raises ValueError if it is not in the space."""
+        methods = tuple(methods)
+        length = len(methods) - 1
+        if not methods or methods[0] != self.first or len(set(methods)) != len(methods):
+            raise ValueError(f"Not a sequence of this space: {methods}")
+        for candidate, start, _ in self._lengths:
+            if candidate == length:
+                break
+        else:
+            raise ValueError(f"Not a sequence of this space: {methods}")
+
+        pool = list(self.others)
+        rank = 0
+        for position, method in enumerate(methods[1:]):
+            if method not in pool:
+                raise ValueError(f"Not a sequence of this space: {methods}")
+            choice = pool.index(method)
+            rank += choice * math.perm(len(pool) - 1, length - position - 1)
+            pool.pop(choice)
+        return start + rank
+
+    def hash(self, index):
+        """Return the SHA-256 hash of the sequence at rank `index`."""
+        hash_value = self._hashes.get(index)
+        if hash_value is None:
+            hash_value = generate_hash(", ".join(self.unrank(index)))
+            self._hashes[index] = hash_value
+            self._by_hash[hash_value] = index
+        return hash_value
+
+    def get(self, index):
+        """Return the (methods, hash) pair at rank `index`."""
+        return self.unrank(index), self.hash(index)
+
+    def find_by_hash(self, hash_value):
+        """Return the methods tuple for `hash_value`."""
+        index = self._by_hash.get(hash_value)
+        if index is None and not self._all_hashed:
+            # A hash can only be reversed by hashing the space; do it once
+            with self._lock:
+                if not self._all_hashed:
+                    for rank in range(self._size):
+                        self.hash(rank)
+                    self._all_hashed = True
+            index = self._by_hash.get(hash_value)
+        if index is None:
+            raise ValueError(f"No sequence found for hash: {hash_value}")
+        return self.unrank(index)
+
+    def fingerprint(self):
+        """Short digest of the whole space; equal fingerprints mean equal sequence IDs."""
+        if self._fingerprint is None:
+            self._fingerprint = table_fingerprint(self.hash(rank) for rank in range(self._size))
+        return self._fingerprint
+
+    def reload_if_changed(self):
+        """Nothing to reload; lets a TableWatcher treat this like a SequenceRegistry."""
+        return None
+
+_space = None
+_space_lock = threading.Lock()
+
+def get_sequence_space():
+    """Return the process-wide default SequenceSpace."""
+    global _space
+    if _space is None:
+        with _space_lock:
+            if _space is None:
+                _space = SequenceSpace()
+    return _space
@@ -1,18 +1,169 @@
 import csv
 import hashlib
+import logging
+import os
+import threading
+import time
 
-def find_sequence_by_hash(hash_value, csv_file='sequence.csv'):
+# Compact sequence IDs are a sequence's index in the table, sent as a uint16
+MAX_SEQUENCE_ID = 0xFFFF
+
+def parse_sequence(sequence_str):
+    """Turn a stored sequence string such as '"rsa, aes"' into a tuple of methods."""
+    return tuple(method.strip() for method in sequence_str.strip('"').split(','))
+
+class SequenceRegistry:
+    """In-memory index of a sequence CSV.
+
+    The table is loaded once into a hash -> methods dict and an
+    index -> (methods, hash) list. The file's mtime is re-checked at most
+    every `check_interval` seconds and the table reloaded when it changes.
+    """
+
+    def __init__(self, csv_file='sequence.csv', check_interval=1.0):
+        self.csv_file = csv_file
+        self.check_interval = check_interval
+        self._by_hash = {}
+        self._by_index = []
+        self._mtime = None
+        self._next_check = 0.0
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)load the table from disk, reusing the entries that did not change.
+
+        Returns {'changed': n, 'added': n, 'removed': n}: rows present before
+        and after that now hold a different sequence, and hashes that
+        appeared or disappeared.
+        """
+        started = time.perf_counter()
+        old_by_hash, old_by_index = self._by_hash, self._by_index
+        by_hash = {}
+        by_index = []
+        mtime = os.stat(self.csv_file).st_mtime_ns
+        with open(self.csv_file, 'r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader)  # Skip header row
+            for row in reader:
+                if len(row) >= 2:  # Ensure row has sequence and hash
+                    hash_value = row[1]
+                    methods = old_by_hash.get(hash_value)
+                    if methods is None:
+                        methods = parse_sequence(row[0])
+                    by_hash[hash_value] = methods
+                    by_index.append((methods, hash_value))
+
+        # Swap both tables in together so readers never see a half-built one
+        self._by_hash, self._by_index = by_hash, by_index
+        self._fingerprint = None
+        reloading = self._mtime is not None
+        self._mtime = mtime
+
+        stats = {
+            # zip() stops at the shorter table; rows beyond it count as added or removed
+            'changed': sum(1 for old_entry, entry in zip(old_by_index, by_index) if old_entry[1] != entry[1]),
+            'added': sum(1 for hash_value in by_hash if hash_value not in old_by_hash),
+            'removed': sum(1 for hash_value in old_by_hash if hash_value not in by_hash)
+        }
+        if reloading:
+            logging.info(
+                f"Reloaded {self.csv_file}: {stats['changed']} changed, {stats['added']} added, "
+                f"{stats['removed']} removed in {(time.perf_counter() - started) * 1000:.1f} ms"
+            )
+        return stats
+
+    def reload_if_changed(self):
+        """Reload if the file changed since the last load; returns the load() stats or None."""
+        with self._lock:
+            if self._mtime is None or os.stat(self.csv_file).st_mtime_ns == self._mtime:
+                return None
+            self._next_check = time.monotonic() + self.check_interval
+            return self.load()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtime is not None and now < self._next_check:
+            return
+        with self._lock:
+            if self._mtime is not None and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            if self._mtime is None or os.stat(self.csv_file).st_mtime_ns != self._mtime:
+                self.load()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._by_index)
+
+    def find_by_hash(self, hash_value):
+        """Return the methods tuple for `hash_value`."""
+        self._refresh()
+        methods = self._by_hash.get(hash_value)
+        if methods is None:
+            raise ValueError(f"No sequence found for hash: {hash_value}")
+        return methods
+
+    def get(self, index):
+        """Return the (methods, hash) pair stored at row `index`."""
+        self._refresh()
+        return self._by_index[index]
+
+    def fingerprint(self):
+        """Short digest of the whole table; equal fingerprints mean equal sequence IDs."""
+        self._refresh()
+        fingerprint = self._fingerprint
+        if fingerprint is None:
+            fingerprint = self._fingerprint = table_fingerprint(hash_value for _, hash_value in self._by_index)
+        return fingerprint
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+def get_sequence_registry(csv_file=None):
+    """Return the process-wide SequenceRegistry for `csv_file`.
+
+    None (the default) returns the computed RSA-first sequence space (see
+    sequence_space), which needs no file at all and covers every row of
+    sequence.csv.
+    """
+    if csv_file is None:
+        from sequence_space import get_sequence_space
+        return get_sequence_space()
+    key = os.path.abspath(csv_file)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = SequenceRegistry(csv_file)
+            _registries[key] = registry
+        return registry
+
+def table_fingerprint(hashes):
+    """Fingerprint a sequence table from its hashes in index order."""
+    return hashlib.sha256("".join(hashes).encode()).hexdigest()[:16]
+
+def supports_sequence_ids(registry):
+    return len(registry) <= MAX_SEQUENCE_ID + 1
+
+def sequence_reference(sequence_id, sequence_hash, compact):
+    """Payload fields naming a sequence: its compact ID if negotiated, else its hash."""
+    if compact:
+        return {"sequence_id": sequence_id}
+    return {"sequence_hash": sequence_hash}
+
+def resolve_sequence(payload, registry):
+    """Return (methods, hash) for the sequence a payload names, by ID or by hash."""
+    sequence_id = payload.get("sequence_id")
+    if sequence_id is None:
+        sequence_hash = payload["sequence_hash"]
+        return registry.find_by_hash(sequence_hash), sequence_hash
+    if not isinstance(sequence_id, int) or not 0 <= sequence_id < min(len(registry), MAX_SEQUENCE_ID + 1):
+        raise ValueError(f"Invalid sequence id: {sequence_id}")
+    return registry.get(sequence_id)
+
+def find_sequence_by_hash(hash_value, csv_file=None):
     """Find the encryption sequence corresponding to a hash value."""
-    with open(csv_file, 'r', newline='') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header row
-        for row in reader:
-            if len(row) >= 2 and row[1] == hash_value:
-                sequence_str = row[0].strip('"')  # Remove quotes
-                methods = [method.strip() for method in sequence_str.split(',')]
-                return methods
-    
-    raise ValueError(f"No sequence found for hash: {hash_value}")
+    return get_sequence_registry(csv_file).find_by_hash(hash_value)
 
 def generate_hash(sequence_str):
     """Generate SHA-256 hash for a sequence string."""
@@ -14,12 +14,15 @@ import csv
 from datetime import datetime
 
 # Import cryptographic modules
-from key_loader import get_random_keys, get_keys_by_index
+from key_loader import get_random_keys
+from key_rotation import get_key_ring
 from encryption import encrypt_data
 from decryption import decrypt_data
 from digital_signature import generate_signature, verify_signature
-from quantum_generator import get_random_sequence_from_csv
-from sequence_utils import find_sequence_by_hash
+from quantum_generator import get_random_sequence
+from sequence_utils import get_sequence_registry, resolve_sequence
+from cipher_plan import compile_plan
+from framing import FramedSocket
 
 # Configure logging
 logging.basicConfig(
@@ -410,6 +413,8 @@ class CommanderGUI:
 
     def _initialize_crypto(self):
         try:
+            self.key_store = get_key_ring()
+            self.sequence_registry = get_sequence_registry(None)
             keys = get_random_keys()
             (
                 self.key_aes,
@@ -421,7 +426,7 @@ class CommanderGUI:
                 self.public_key_ecc,
             ) = keys
             
-            self.methods, self.sequence_hash = get_random_sequence_from_csv()
+            self.methods, self.sequence_hash = get_random_sequence()
             self.crypto_initialized = True
             self.log("Cryptography initialized successfully")
         except Exception as e:
@@ -465,7 +470,7 @@ class CommanderGUI:
                 
                 client_thread = threading.Thread(
                     target=self.handle_client,
-                    args=(conn, addr),
+                    args=(FramedSocket(conn), addr),
                     daemon=True
                 )
                 client_thread.start()
@@ -475,7 +480,7 @@ class CommanderGUI:
 
     def handle_client(self, conn, addr):
         try:
-            tank_id = conn.recv(1024).decode().strip()
+            tank_id = conn.read_text().strip()
             self.log(f"Tank {tank_id} connected")
             
             # Add to tank list
@@ -483,17 +488,17 @@ class CommanderGUI:
             
             # Generate and send challenge
             challenge_msg, expected_answer = self.generate_challenge()
-            conn.send(f"Challenge: {challenge_msg}".encode())
+            conn.send_frame(f"Challenge: {challenge_msg}")
             
             # Handle authentication
-            response = conn.recv(1024).decode().strip()
+            response = conn.read_text().strip()
             
             if response == expected_answer:
-                conn.send("Authentication Successful".encode())
+                conn.send_frame("Authentication Successful")
                 self.log(f"Tank {tank_id} authenticated")
                 self.handle_tank_communication(conn, tank_id)
             else:
-                conn.send("Authentication Failed".encode())
+                conn.send_frame("Authentication Failed")
                 self.log(f"Tank {tank_id} authentication failed")
             
         except Exception as e:
@@ -542,27 +547,16 @@ class CommanderGUI:
 
     def handle_tank_communication(self, conn, tank_id):
         try:
-            conn.send("Are you ready?".encode())
-            readiness = conn.recv(1024).decode().strip()
+            conn.send_frame("Are you ready?")
+            readiness = conn.read_text().strip()
             
             if readiness.lower() in ["yes", "ready", "ok"]:
                 while True:
-                    conn.send("Give me your location".encode())
-                    
-                    data = ""
-                    while True:
-                        chunk = conn.recv(1024).decode()
-                        if not chunk:
-                            break
-                        data += chunk
-                        if "\n" in data:
-                            break
-                    
-                    if not data:
-                        break
+                    conn.send_frame("Give me your location")
+                    data = conn.read_text()
                     
                     try:
-                        payload = json.loads(data.strip())
+                        payload = json.loads(data)
                         location = self.decrypt_location(payload, tank_id)
                         
                         if location:
@@ -581,17 +575,17 @@ class CommanderGUI:
     def decrypt_location(self, payload, tank_id):
         try:
             index = payload["random_index"]
-            hash_value = payload["sequence_hash"]
-            methods = find_sequence_by_hash(hash_value)
+            methods, hash_value = resolve_sequence(payload, self.sequence_registry)
             
             if not methods:
                 return None
                 
-            keys = get_keys_by_index(index)
+            keys = self.key_store.get_keys(index)
             if not keys or len(keys) != 7:
                 return None
                 
-            key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc = keys
+            key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc = compile_plan(methods).decryption_keys(keys)
+            rsa_verifier = keys.public_rsa_verifier
             
             decrypted_location = decrypt_data(
                 payload["ivs"],
@@ -602,13 +596,14 @@ class CommanderGUI:
                 key_des,
                 key_tdes,
                 private_key_rsa,
-                private_key_ecc
+                private_key_ecc,
+                binary=payload.get("format") == "binary"
             )
             
             is_valid = verify_signature(
                 decrypted_location,
                 payload["signature"],
-                public_key_rsa
+                rsa_verifier
             )
             
             if not is_valid:
@@ -1,8 +1,6 @@
 import sys
-import socket
 import random
 import logging
-import threading
 import subprocess
 import tkinter as tk
 from tkinter import scrolledtext, ttk, messagebox
@@ -12,15 +10,23 @@ import time
 import json
 import csv
 import os
+import queue
+import threading
 from datetime import datetime
 
 # Import cryptographic modules
-from key_loader import get_random_keys, get_keys_by_index
-from encryption import encrypt_data
+from key_loader import get_random_keys
+from key_rotation import get_key_ring, KeyRotationService
+from table_watcher import TableWatcher
 from decryption import decrypt_data
 from digital_signature import generate_signature, verify_signature
-from quantum_generator import get_random_sequence_from_csv
-from sequence_utils import find_sequence_by_hash
+from quantum_generator import get_random_sequence, get_random_sequence_entry
+from sequence_utils import get_sequence_registry, resolve_sequence, sequence_reference, supports_sequence_ids
+from cipher_plan import compile_plan
+from decrypt_pool import DecryptionPool
+from session_crypto import accept_session
+from commander_core import CommanderServerCore
+from payload_codec import PAYLOAD_CODEC_VERSION, encode_payload
 
 # Configure logging
 logging.basicConfig(
@@ -39,8 +45,21 @@ class CommanderGUI:
         self.root.geometry("1400x800")
         
         # Initialize variables
-        self.server_socket = None
+        self.server_core = None
+        # Listening address and accept backlog of the asyncio server core
+        self.bind_address = 'localhost'
+        self.port = 5000
+        self.listen_backlog = 1024
+        self.crypto_workers = None  # threads decrypting off the event loop (None = executor default)
+        # Outgoing frames queued per tank; chat waits up to chat_send_timeout for room
+        self.send_queue_size = 64
+        self.chat_send_timeout = 5.0
         self.connected_tanks = {}  # {tank_id: connection}
+        self.tank_sessions = {}  # {tank_id: Session}, for tanks that negotiated a session key
+        self.tank_sequence_ids = {}  # {tank_id: True}, for tanks that negotiated compact sequence IDs
+        self.tank_binary_payloads = {}  # {tank_id: True}, for tanks that negotiated the binary payload codec
+        self.tank_streams = {}  # {tank_id: ack window}, for tanks that push locations instead of being polled
+        self.location_streaming = True  # Accept client-push location streams
         self.tank_markers = {}
         self.tank_paths = {}
         self.server_running = False
@@ -48,6 +67,25 @@ class CommanderGUI:
         self.show_paths = False
         self.message_processing = False
         
+        # GUI updates requested by the server core's threads, run on the Tk thread every gui_poll_interval ms
+        self.gui_calls = queue.Queue()
+        self.gui_poll_interval = 50
+        self._gui_thread = threading.get_ident()
+        
+        # Process-pool decryption backend (0 workers decrypts inline on the connection thread)
+        self.decrypt_workers = 0
+        self.decrypt_queue_depth = 64
+        self.decrypt_pool = None
+        
+        # Background key rotation (0 disables it); old keys stay valid for the grace period
+        self.key_rotation_interval = 0
+        self.key_rotation_grace = 300.0
+        self.key_rotation = None
+        
+        # Poll the key and sequence files and reload changed entries (0 disables it)
+        self.table_watch_interval = 1.0
+        self.table_watcher = None
+        
         # Ensure history directory exists
         self.history_dir = "tank_history"
         os.makedirs(self.history_dir, exist_ok=True)
@@ -72,6 +110,8 @@ class CommanderGUI:
         self.create_map_tab()
         self.create_chat_tab()
         self.create_user_management_tab()
+        
+        self.root.after(self.gui_poll_interval, self._run_gui_calls)
     
     def setup_styles(self):
         style = ttk.Style()
@@ -83,9 +123,28 @@ class CommanderGUI:
         style.configure("Online.TLabel", foreground="green")
         style.configure("Offline.TLabel", foreground="red")
 
+    def _refresh_keys(self):
+        """Move to a key set of the current generation once keys have been rotated"""
+        if self.key_store.is_current(self.random_index):
+            return
+        self.random_index = self.key_store.select_random_index()
+        self.keys = self.key_store.get_keys(self.random_index)
+        (
+            self.key_aes,
+            self.key_des,
+            self.key_tdes,
+            self.private_key_rsa,
+            self.public_key_rsa,
+            self.private_key_ecc,
+            self.public_key_ecc
+        ) = self.keys
+        self.log(f"Switched to rotated key set {self.random_index}")
+
     def _initialize_crypto(self):
         """Initialize cryptographic components"""
         try:
+            self.key_store = get_key_ring()
+            self.sequence_registry = get_sequence_registry(None)
             keys = get_random_keys()
             (
                 self.key_aes,
@@ -97,8 +156,10 @@ class CommanderGUI:
                 self.public_key_ecc,
                 self.random_index
             ) = keys
+            # The PreparedKeys behind the tuple, which also caches the RSA schemes
+            self.keys = self.key_store.get_keys(self.random_index)
             
-            self.methods, self.sequence_hash = get_random_sequence_from_csv()
+            self.methods, self.sequence_hash = get_random_sequence()
             self.crypto_initialized = True
             logging.info("Cryptography initialized successfully")
         except Exception as e:
@@ -529,18 +590,40 @@ class CommanderGUI:
         """Start the server"""
         if not self.server_running:
             try:
-                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.server_socket.bind(('localhost', 5000))
-                self.server_socket.listen(5)
+                self.server_core = CommanderServerCore(
+                    self,
+                    host=self.bind_address,
+                    port=self.port,
+                    backlog=self.listen_backlog,
+                    crypto_workers=self.crypto_workers,
+                    send_queue_size=self.send_queue_size
+                )
+                self.server_core.start()
                 self.server_running = True
                 
+                if self.decrypt_workers and not self.decrypt_pool:
+                    self.decrypt_pool = DecryptionPool(self.decrypt_workers, self.decrypt_queue_depth, csv_file=None)
+                    self.log(f"Decryption pool started with {self.decrypt_workers} workers")
+                
+                if self.key_rotation_interval and not self.key_rotation:
+                    self.key_rotation = KeyRotationService(
+                        self.key_store,
+                        grace_period=self.key_rotation_grace,
+                        interval=self.key_rotation_interval
+                    )
+                    self.key_rotation.start()
+                    self.log(f"Key rotation every {self.key_rotation_interval}s")
+                
+                if self.table_watch_interval and not self.table_watcher:
+                    self.table_watcher = TableWatcher(
+                        [self.key_store, self.sequence_registry],
+                        interval=self.table_watch_interval
+                    )
+                    self.table_watcher.start()
+                
                 self.server_status.config(text="Server Status: Running")
                 self.start_button.config(text="Stop Server")
-                self.log("Server started successfully")
-                # self.log("Server started on localhost:5000")
-                
-                # Start accepting connections in a separate thread
-                threading.Thread(target=self.accept_connections, daemon=True).start()
+                self.log(f"Server started on {self.bind_address}:{self.port}")
                 
             except Exception as e:
                 self.log(f"Failed to start server: {e}", "ERROR")
@@ -552,11 +635,25 @@ class CommanderGUI:
         if self.server_running:
             try:
                 self.server_running = False
-                if self.server_socket:
-                    self.server_socket.close()
+                if self.server_core:
+                    # The loop thread winds down the connections on its own; never wait for it here
+                    self.server_core.stop(wait=False)
+                    self.server_core = None
+                
+                if self.decrypt_pool:
+                    self.decrypt_pool.shutdown(wait=False)
+                    self.decrypt_pool = None
+                
+                if self.key_rotation:
+                    self.key_rotation.stop()
+                    self.key_rotation = None
+                
+                if self.table_watcher:
+                    self.table_watcher.stop()
+                    self.table_watcher = None
                 
                 # Close all tank connections
-                for tank_id, conn in self.connected_tanks.items():
+                for tank_id, conn in list(self.connected_tanks.items()):
                     try:
                         conn.close()
                     except:
@@ -573,57 +670,42 @@ class CommanderGUI:
             except Exception as e:
                 self.log(f"Error stopping server: {e}", "ERROR")
 
-    def accept_connections(self):
-        """Accept incoming connections"""
-        while self.server_running:
-            try:
-                conn, addr = self.server_socket.accept()
-                self.log(f"New connection from {addr}")
-                threading.Thread(
-                    target=self.handle_client,
-                    args=(conn, addr),
-                    daemon=True
-                ).start()
-            except:
-                if self.server_running:
-                    self.log("Error accepting connection", "ERROR")
-
-    def handle_client(self, conn, addr):
-        """Handle client connection"""
-        try:
-            tank_id = conn.recv(1024).decode().strip()
-            self.log(f"Tank {tank_id} connected")
-            
-            # Add to tank list and update UI
-            self.root.after(0, lambda: self.tank_listbox.insert(tk.END, tank_id))
-
-            self.root.after(0, lambda: self.update_chat_tank_list(tank_id, True))
-            self.connected_tanks[tank_id] = conn
-            
-            # Generate and send challenge
-            challenge_msg, expected_answer = self.generate_challenge()
-            conn.send(f"Challenge: {challenge_msg}".encode())
-            
-            # Handle authentication
-            response = conn.recv(1024).decode().strip()
-            
-            if response == expected_answer:
-                conn.send("Authentication Successful".encode())
-                self.log(f"Tank {tank_id} authenticated")
-                self.handle_tank_communication(conn, tank_id)
-            else:
-                conn.send("Authentication Failed".encode())
-                self.log(f"Tank {tank_id} authentication failed")
-            
-        except Exception as e:
-            self.log(f"Error handling client: {e}", "ERROR")
-        finally:
-            if tank_id in self.connected_tanks:
-                del self.connected_tanks[tank_id]
-            conn.close()
-            # Remove from tank list and update UI
-            self.root.after(0, lambda: self.remove_tank(tank_id))
-            self.root.after(0, lambda: self.update_chat_tank_list(tank_id, False))
+    def tank_connected(self, tank_id, conn):
+        """Register a tank connection (called by the server core)"""
+        self.log(f"Tank {tank_id} connected")
+        self.connected_tanks[tank_id] = conn
+        
+        # Add to tank list and update UI
+        self.call_in_gui(self.tank_listbox.insert, tk.END, tank_id)
+        self.call_in_gui(self.update_chat_tank_list, tank_id, True)
+
+    def tank_disconnected(self, tank_id):
+        """Forget a tank connection and its negotiated state (called by the server core)"""
+        if self.connected_tanks.get(tank_id) is not None:
+            del self.connected_tanks[tank_id]
+        self.tank_sessions.pop(tank_id, None)
+        self.tank_sequence_ids.pop(tank_id, None)
+        self.tank_binary_payloads.pop(tank_id, None)
+        self.tank_streams.pop(tank_id, None)
+        # Remove from tank list and update UI
+        self.call_in_gui(self.update_tank_status, tank_id, False)
+        self.call_in_gui(self.remove_tank, tank_id)
+        self.call_in_gui(self.update_chat_tank_list, tank_id, False)
+
+    def tank_send_stats(self):
+        """Return {tank_id: send queue and byte counters} for the connected tanks"""
+        return {tank_id: conn.stats() for tank_id, conn in list(self.connected_tanks.items())}
+
+    def prepare_challenge(self):
+        """Return (challenge message, expected answer) for a new tank"""
+        challenge_msg, expected_answer = self.generate_challenge()
+        # Advertise capabilities; older tanks only parse the first two numbers
+        if " " not in challenge_msg:
+            challenge_msg += " 0"
+        if supports_sequence_ids(self.sequence_registry):
+            challenge_msg += f" sequence-table={self.sequence_registry.fingerprint()}"
+        challenge_msg += f" payload-codec={PAYLOAD_CODEC_VERSION}"
+        return challenge_msg, expected_answer
 
     def remove_tank(self, tank_id):
         for i in range(self.tank_listbox.size()):
@@ -670,87 +752,98 @@ class CommanderGUI:
             return str(len(bin(num)) - 2)
         return "OK"
 
-    def handle_tank_communication(self, conn, tank_id):
-        """Handle communication with tank"""
-        try:
-            # Update tank status to online
-            self.root.after(0, lambda: self.update_tank_status(tank_id, True))
-            
-            conn.send("Are you ready?".encode())
-            readiness = conn.recv(1024).decode().strip()
-            
-            print(readiness)
-            
-            if readiness.lower() in ["yes", "ready", "ok"]:
-                while True:
-                    conn.send("Give me your location".encode())
-                    
-                    data = ""
-                    while True:
-                        chunk = conn.recv(1024).decode()
-                        if not chunk:
-                            raise ConnectionError("Connection lost")
-                        
-                        data += chunk
-                        if "\n" in data:
-                            break
-
-                    if not data:
-                        continue
+    def process_readiness(self, readiness, tank_id):
+        """Handle a tank's readiness reply; returns the bare answer ("yes", ...)
+        
+        A reply starting with "{" is a JSON frame carrying a session offer,
+        the tank's sequence table fingerprint, its payload codec version
+        and/or a location stream request.
+        """
+        self.call_in_gui(self.update_tank_status, tank_id, True)
+        if readiness.startswith("{"):
+            ready = json.loads(readiness)
+            if ready.get("type") == "session":
+                self.tank_sessions[tank_id] = accept_session(ready, self.key_store)
+                self.log(f"Session key established with Tank {tank_id}")
+            if ready.get("sequence_table") == self.sequence_registry.fingerprint():
+                self.tank_sequence_ids[tank_id] = True
+                self.log(f"Compact sequence IDs enabled for Tank {tank_id}")
+            if ready.get("payload_codec") == PAYLOAD_CODEC_VERSION:
+                self.tank_binary_payloads[tank_id] = True
+                self.log(f"Binary payloads enabled for Tank {tank_id}")
+            stream = ready.get("stream")
+            if self.location_streaming and stream:
+                self.tank_streams[tank_id] = max(1, int(stream.get("window", 1)))
+            readiness = "yes"
+        return readiness.strip()
+
+    def process_tank_payload(self, payload, tank_id):
+        """Handle one chat or location payload; returns the reply to send back, if any"""
+        if payload.get("type") == "chat":
+            # Handle chat message
+            decrypted_message = self.decrypt_message(payload, tank_id)
+            if decrypted_message:
+                self.call_in_gui(
+                    self.show_notification,
+                    "New Message",
+                    f"From {tank_id}: {decrypted_message[:50]}..."
+                )
+                self.call_in_gui(self.add_chat_message, tank_id, decrypted_message)
+            return None
 
-                    try:
-                        payload = json.loads(data.strip())
-                        
-                        if payload.get("type") == "chat":
-                            # Handle chat message
-                            decrypted_message = self.decrypt_message(payload)
-                            if decrypted_message:
-                                self.root.after(0, lambda: self.show_notification(
-                                    "New Message",
-                                    f"From {tank_id}: {decrypted_message[:50]}..."
-                                ))
-                                self.root.after(0, lambda: self.add_chat_message(
-                                    tank_id,
-                                    decrypted_message
-                                ))
-                        else:
-                            # Handle location update
-                            location = self.decrypt_location(payload, tank_id)
-                            if location:
-                                lat, lon = map(float, location.split(","))
-                                self.root.after(0, lambda: self.update_tank_marker(tank_id, lat, lon))
-                                self.log(f"Location received from Tank {tank_id}: {lat}, {lon}")
-                                # Send "Received" status back to the client
-                                conn.send("Location received successfully".encode())
-                    
-                    except json.JSONDecodeError:
-                        self.log(f"Invalid JSON from Tank {tank_id}", "ERROR")
-                    except Exception as e:
-                        self.log(f"Error processing data from Tank {tank_id}: {e}", "ERROR")
-                        
-        except Exception as e:
-            self.log(f"Communication error with Tank {tank_id}: {e}", "ERROR")
-        finally:
-            # Update tank status to offline
-            self.root.after(0, lambda: self.update_tank_status(tank_id, False))
+        # Handle location update
+        location = self.decrypt_location(payload, tank_id)
+        if location:
+            lat, lon = map(float, location.split(","))
+            self.call_in_gui(self.update_tank_marker, tank_id, lat, lon)
+            self.log(f"Location received from Tank {tank_id}: {lat}, {lon}")
+            # Send "Received" status back to the client
+            return "Location received successfully"
+        return None
+
+    def decrypt_session_payload(self, payload, tank_id):
+        """Decrypt a payload protected by the tank's session key"""
+        session = self.tank_sessions.get(tank_id)
+        if not session:
+            self.log(f"No session key for Tank {tank_id}", "ERROR")
+            return None
+
+        methods, _ = resolve_sequence(payload, self.sequence_registry)
+        decrypted_data = session.decrypt(payload["ivs"], payload["data"], payload["tags"], methods)
+
+        if not session.verify(decrypted_data, payload["signature"], payload.get("counter")):
+            self.log(f"Invalid or replayed session message from Tank {tank_id}", "ERROR")
+            return None
+
+        return decrypted_data
 
     def decrypt_location(self, payload, tank_id):
         """Decrypt location data from tank"""
         try:
+            if payload.get("session"):
+                return self.decrypt_session_payload(payload, tank_id)
+
+            if self.decrypt_pool:
+                decrypted_location, is_valid = self.decrypt_pool.submit(payload).result()
+                if not is_valid:
+                    self.log(f"Invalid signature from Tank {tank_id}", "ERROR")
+                    return None
+                return decrypted_location
+
             index = payload["random_index"]
-            hash_value = payload["sequence_hash"]
-            methods = find_sequence_by_hash(hash_value)
+            methods, hash_value = resolve_sequence(payload, self.sequence_registry)
 
             if not methods:
                 self.log(f"Invalid sequence hash from Tank {tank_id}", "ERROR")
                 return None
 
-            keys = get_keys_by_index(index)
+            keys = self.key_store.get_keys(index)
             if not keys or len(keys) != 7:
                 self.log(f"Invalid keys for Tank {tank_id}", "ERROR")
                 return None
 
-            key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc = keys
+            key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc = compile_plan(methods).decryption_keys(keys)
+            rsa_verifier = keys.public_rsa_verifier
 
             decrypted_location = decrypt_data(
                 payload["ivs"],
@@ -761,13 +854,14 @@ class CommanderGUI:
                 key_des,
                 key_tdes,
                 private_key_rsa,
-                private_key_ecc
+                private_key_ecc,
+                binary=payload.get("format") == "binary"
             )
 
             is_valid = verify_signature(
                 decrypted_location,
                 payload["signature"],
-                public_key_rsa
+                rsa_verifier
             )
 
             if not is_valid:
@@ -811,38 +905,45 @@ class CommanderGUI:
 
         try:
             # Get new encryption sequence for this message
-            methods, sequence_hash = get_random_sequence_from_csv()
+            sequence_id, methods, sequence_hash = get_random_sequence_entry()
 
             # Encrypt message
-            signature = generate_signature(message, self.private_key_rsa)
-            ivs, encrypted_data, tags = encrypt_data(
-                message,
-                methods,
-                self.key_aes,
-                self.key_des,
-                self.key_tdes,
-                self.public_key_rsa,
-                self.public_key_ecc
-            )
+            session = self.tank_sessions.get(selected_tank)
+            if not session:
+                self._refresh_keys()
+            if session:
+                counter, signature = session.sign(message)
+                ivs, encrypted_data, tags = session.encrypt(message, methods)
+            else:
+                # The key set's cached signer and OAEP cipher; only the keys this sequence uses are built
+                plan = compile_plan(methods)
+                signature = generate_signature(message, self.keys.private_rsa_signer)
+                ivs, encrypted_data, tags = plan.encrypt(message, *plan.encryption_keys(self.keys), binary=True)
 
             # Prepare payload
             payload = {
                 "type": "chat",
+                "format": "binary",
+                "session": session is not None,
                 "ivs": ivs,
                 "data": encrypted_data,
                 "tags": tags,
                 "signature": signature,
                 "random_index": self.random_index,
-                "sequence_hash": sequence_hash,
+                **sequence_reference(sequence_id, sequence_hash, self.tank_sequence_ids.get(selected_tank, False)),
                 "sender": "Commander"
             }
+            if session:
+                payload["counter"] = counter
 
-            # Send encrypted message
+            # Queue the message on the tank's event loop so a backed-up tank never blocks the GUI
             conn = self.connected_tanks[selected_tank]
-            conn.sendall(f"{json.dumps(payload)}\n".encode())
-
-            # Add message to chat display
-            self.add_chat_message("You", message)
+            future = conn.send_frame_soon(
+                encode_payload(payload, self.tank_binary_payloads.get(selected_tank, False)),
+                self.chat_send_timeout
+            )
+            future.add_done_callback(
+                lambda done: self.call_in_gui(self.chat_message_queued, done, selected_tank, message))
 
             # Clear input field
             self.message_input.delete(0, tk.END)
@@ -850,21 +951,43 @@ class CommanderGUI:
         except Exception as e:
             self.log(f"Error sending message: {e}", "ERROR")
 
-    def decrypt_message(self, payload):
+    def chat_message_queued(self, future, tank_id, message):
+        """Show a chat message once it is queued, or report why it was not sent"""
+        try:
+            future.result()
+        except queue.Full:
+            self.log(f"Send queue to Tank {tank_id} full; chat message not sent", "WARNING")
+            self.add_chat_message("System", f"Not sent to Tank {tank_id} (connection backed up): {message}")
+            return
+        except Exception as e:
+            self.log(f"Error sending message: {e}", "ERROR")
+            return
+
+        # Add message to chat display
+        self.add_chat_message("You", message)
+
+    def decrypt_message(self, payload, tank_id=None):
         """Decrypt incoming message"""
         try:
+            if payload.get("session"):
+                return self.decrypt_session_payload(payload, tank_id)
+
+            if self.decrypt_pool:
+                decrypted_message, is_valid = self.decrypt_pool.submit(payload).result()
+                return decrypted_message if is_valid else None
+
             index = payload["random_index"]
-            hash_value = payload["sequence_hash"]
-            methods = find_sequence_by_hash(hash_value)
+            methods, hash_value = resolve_sequence(payload, self.sequence_registry)
 
             if not methods:
                 return None
 
-            keys = get_keys_by_index(index)
+            keys = self.key_store.get_keys(index)
             if not keys or len(keys) != 7:
                 return None
 
-            key_aes, key_des, key_tdes, private_key_rsa, public_key_rsa, private_key_ecc, public_key_ecc = keys
+            key_aes, key_des, key_tdes, private_key_rsa, private_key_ecc = compile_plan(methods).decryption_keys(keys)
+            rsa_verifier = keys.public_rsa_verifier
 
             decrypted_message = decrypt_data(
                 payload["ivs"],
@@ -875,13 +998,14 @@ class CommanderGUI:
                 key_des,
                 key_tdes,
                 private_key_rsa,
-                private_key_ecc
+                private_key_ecc,
+                binary=payload.get("format") == "binary"
             )
 
             is_valid = verify_signature(
                 decrypted_message,
                 payload["signature"],
-                public_key_rsa
+                rsa_verifier
             )
 
             if not is_valid:
@@ -1010,17 +1134,36 @@ class CommanderGUI:
             "offline": self.offline_tanks_list
         }
 
+    def call_in_gui(self, function, *args):
+        """Run function(*args) on the Tk thread; safe to call from any thread"""
+        if threading.get_ident() == self._gui_thread:
+            function(*args)
+        else:
+            self.gui_calls.put((function, args))
+
+    def _run_gui_calls(self):
+        """Run the GUI updates queued by other threads, then poll again"""
+        for _ in range(self.gui_calls.qsize()):
+            function, args = self.gui_calls.get_nowait()
+            try:
+                function(*args)
+            except Exception as e:
+                logging.error(f"GUI update failed: {e}")
+        self.root.after(self.gui_poll_interval, self._run_gui_calls)
+
     def log(self, message, level="INFO"):
-        """Add message to log area"""
+        """Add message to log area; safe to call from any thread"""
         timestamp = time.strftime("%H:%M:%S")
-        log_message = f"[{timestamp}] {level}: {message}\n"
-        self.log_area.insert(tk.END, log_message)
-        self.log_area.see(tk.END)
+        self.call_in_gui(self._append_log, f"[{timestamp}] {level}: {message}\n")
         logging.log(
             getattr(logging, level),
             message
         )
 
+    def _append_log(self, log_message):
+        self.log_area.insert(tk.END, log_message)
+        self.log_area.see(tk.END)
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = CommanderGUI(root)
@@ -0,0 +1,150 @@
+import hmac
+import base64
+import struct
+import threading
+from Crypto.Cipher import DES3
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.Random import get_random_bytes
+
+from encryption import encrypt_data
+from decryption import decrypt_data
+from digital_signature import generate_signature, verify_signature
+
+# Asymmetric layers used once per session to wrap the session key
+SESSION_WRAP_METHODS = ('rsa', 'ecc')
+ASYMMETRIC_METHODS = ('rsa', 'ecc')
+# Used when a sequence has no symmetric layers at all (e.g. "rsa, ecc")
+DEFAULT_SESSION_METHODS = ('aes-gcm',)
+# HKDF info labels; the side that offered the session sends with INITIATOR_LABEL
+INITIATOR_LABEL = b'Session-Keys initiator'
+RESPONDER_LABEL = b'Session-Keys responder'
+COUNTER = struct.Struct('>Q')
+REPLAY_WINDOW = 64  # Counters this far behind the newest one may still arrive once
+
+def symmetric_methods(methods):
+    """Drop the asymmetric layers from a sequence for use under a session key."""
+    methods = tuple(method for method in methods if method not in ASYMMETRIC_METHODS)
+    return methods or DEFAULT_SESSION_METHODS
+
+def _derive_keys(session_key, label):
+    """Return (aes, des, tdes, mac) keys for one direction of a session."""
+    material = HKDF(session_key, 96, b'', SHA256, context=label)
+    return material[:32], material[32:40], DES3.adjust_key_parity(material[40:64]), material[64:96]
+
+class Session:
+    """Symmetric key material derived from one per-session secret.
+
+    Messages are encrypted with the symmetric layers of their sequence only
+    and authenticated with HMAC-SHA256, so no RSA/ECC work is done per message
+    and there is no OAEP payload size ceiling.
+
+    Each direction has its own keys, so a message can never be reflected
+    back to its sender. Every MAC covers a per-direction counter that
+    sign() increments; verify() accepts each counter once, and only within
+    REPLAY_WINDOW of the newest one seen, so replayed messages are rejected
+    while frames dropped or reordered by the send queue are not.
+    """
+
+    def __init__(self, session_key, initiator=True):
+        send_label, receive_label = INITIATOR_LABEL, RESPONDER_LABEL
+        if not initiator:
+            send_label, receive_label = receive_label, send_label
+        self.send_keys = _derive_keys(session_key, send_label)
+        self.receive_keys = _derive_keys(session_key, receive_label)
+        self._lock = threading.Lock()
+        self._send_counter = 0
+        self._receive_newest = -1
+        self._receive_seen = 0  # Bit i set: counter newest - i was accepted
+
+    def encrypt(self, data, methods):
+        """Encrypt `data` with the symmetric layers of `methods`; returns (ivs, data, tags)."""
+        key_aes, key_des, key_tdes, _ = self.send_keys
+        return encrypt_data(data, symmetric_methods(methods), key_aes, key_des, key_tdes,
+                            None, None, binary=True)
+
+    def decrypt(self, ivs, encrypted_data, tags, methods):
+        key_aes, key_des, key_tdes, _ = self.receive_keys
+        return decrypt_data(ivs, encrypted_data, tags, symmetric_methods(methods), key_aes, key_des,
+                            key_tdes, None, None, binary=True)
+
+    def sign(self, data):
+        """MAC `data` under the next send counter; returns (counter, signature)."""
+        with self._lock:
+            counter = self._send_counter
+            self._send_counter += 1
+        mac = hmac.new(self.send_keys[3], COUNTER.pack(counter) + data.encode(), 'sha256').digest()
+        return counter, base64.b64encode(mac).decode('utf-8')
+
+    def verify(self, data, signature, counter):
+        """Check the MAC of `data` under `counter` and that the counter was not seen before."""
+        if not isinstance(counter, int) or not 0 <= counter < 1 << 64:
+            return False
+        expected = hmac.new(self.receive_keys[3], COUNTER.pack(counter) + data.encode(), 'sha256').digest()
+        try:
+            mac = bytes(signature) if not isinstance(signature, str) else base64.b64decode(signature)
+        except (ValueError, TypeError):
+            return False
+        if not hmac.compare_digest(expected, mac):
+            return False
+
+        with self._lock:
+            if counter > self._receive_newest:
+                shift = counter - self._receive_newest
+                self._receive_seen = (self._receive_seen << shift | 1) & ((1 << REPLAY_WINDOW) - 1)
+                self._receive_newest = counter
+                return True
+            age = self._receive_newest - counter
+            if age >= REPLAY_WINDOW or self._receive_seen >> age & 1:
+                return False
+            self._receive_seen |= 1 << age
+            return True
+
+def create_session(random_index, keys):
+    """Start a session: returns (Session, offer) where offer is the JSON-able message for the peer.
+
+    The session key is wrapped with the RSA and ECC layers of key set
+    `random_index` (`keys`, its PreparedKeys) and the wrapped blob is
+    signed with its RSA private key.
+    """
+    session_key = get_random_bytes(32)
+    ivs, wrapped_key, tags = encrypt_data(
+        base64.b64encode(session_key).decode('utf-8'),
+        SESSION_WRAP_METHODS,
+        None,
+        None,
+        None,
+        keys.public_rsa_oaep,
+        keys.public_ecc,
+        binary=True
+    )
+    offer = {
+        "type": "session",
+        "ivs": ivs,
+        "data": wrapped_key,
+        "tags": tags,
+        "signature": generate_signature(wrapped_key, keys.private_rsa_signer),
+        "random_index": random_index
+    }
+    return Session(session_key, initiator=True), offer
+
+def accept_session(offer, key_store):
+    """Unwrap a peer's session offer with the key set it names."""
+    keys = key_store.get_keys(offer["random_index"])
+
+    if not verify_signature(offer["data"], offer["signature"], keys.public_rsa_verifier):
+        raise ValueError("Invalid session offer signature")
+
+    session_key = decrypt_data(
+        offer["ivs"],
+        offer["data"],
+        offer["tags"],
+        SESSION_WRAP_METHODS,
+        None,
+        None,
+        None,
+        keys.private_rsa_oaep,
+        keys.private_ecc,
+        binary=True
+    )
+    return Session(base64.b64decode(session_key), initiator=False)
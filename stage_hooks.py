@@ -0,0 +1,102 @@
+import os
+import threading
+
+# Registered hooks are called as hook(direction, method, input_size, output_size, elapsed_ns)
+# where direction is 'encrypt' or 'decrypt'. With no hooks and debug off the
+# cipher pipelines skip timing entirely.
+_hooks = []
+_debug = os.environ.get('STAGE_DEBUG') == '1'
+
+def register_stage_hook(hook):
+    """Register a per-stage callback."""
+    if hook not in _hooks:
+        _hooks.append(hook)
+    return hook
+
+def unregister_stage_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+def set_stage_debug(enabled):
+    """Turn full stage input/output dumps on or off (also enabled by STAGE_DEBUG=1)."""
+    global _debug
+    _debug = enabled
+
+def debug_enabled():
+    return _debug
+
+def tracing_enabled():
+    """True when stages need to be timed, i.e. a hook is registered or debug dumps are on."""
+    return bool(_hooks) or _debug
+
+def emit(direction, method, stage_input, stage_output, elapsed_ns):
+    """Report one finished stage to the registered hooks."""
+    if _debug:
+        print(f"\n{direction.capitalize()}ing with {method.upper()} ({elapsed_ns / 1000:.1f} us)")
+        print(f"Input: {stage_input}")
+        print(f"Output: {stage_output}")
+    if _hooks:
+        input_size = len(stage_input)
+        output_size = len(stage_output)
+        for hook in _hooks:
+            hook(direction, method, input_size, output_size, elapsed_ns)
+
+class LatencyHistogram:
+    """Stage hook that aggregates per-method latency in power-of-two buckets.
+
+    Bucket b counts stages that took between 2**(b-1) and 2**b nanoseconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # {(direction, method): [count, total_ns, bytes_in, bytes_out, buckets]}
+
+    def __call__(self, direction, method, input_size, output_size, elapsed_ns):
+        key = (direction, method)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [0, 0, 0, 0, {}]
+            stats[0] += 1
+            stats[1] += elapsed_ns
+            stats[2] += input_size
+            stats[3] += output_size
+            bucket = int(elapsed_ns).bit_length()
+            stats[4][bucket] = stats[4].get(bucket, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _percentile_us(self, count, buckets, fraction):
+        target = count * fraction
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= target:
+                return (1 << bucket) / 1000
+        return 0.0
+
+    def summary(self):
+        """Return {(direction, method): {...}} with counts, mean and bucketed p50/p99 in microseconds."""
+        with self._lock:
+            result = {}
+            for key, (count, total_ns, bytes_in, bytes_out, buckets) in self._stats.items():
+                result[key] = {
+                    'count': count,
+                    'mean_us': total_ns / count / 1000,
+                    'p50_us': self._percentile_us(count, buckets, 0.50),
+                    'p99_us': self._percentile_us(count, buckets, 0.99),
+                    'expansion': bytes_out / bytes_in if bytes_in else 0.0,
+                }
+            return result
+
+    def format(self):
+        lines = []
+        for (direction, method), stats in sorted(self.summary().items()):
+            lines.append(
+                f"{direction:<8}{method:<9}n={stats['count']:<7}"
+                f"mean={stats['mean_us']:.1f}us p50<={stats['p50_us']:.1f}us "
+                f"p99<={stats['p99_us']:.1f}us x{stats['expansion']:.2f}"
+            )
+        return "\n".join(lines)
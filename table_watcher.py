@@ -0,0 +1,44 @@
+import logging
+import threading
+
+class TableWatcher:
+    """Polls key and sequence tables and reloads the ones whose files changed.
+
+    `tables` are objects with a reload_if_changed() method (KeyStore,
+    BinaryKeyStore, KeyRing, SequenceRegistry). Each reload parses the new
+    file outside the table's lock and swaps the new entries in, so lookups
+    and in-flight decrypts are not paused; prepared keys survive for rows
+    that did not change. The tables log each reload's duration and counts.
+    """
+
+    def __init__(self, tables, interval=1.0):
+        self.tables = list(tables)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Poll every table once; returns {table: stats} for the ones that reloaded."""
+        reloaded = {}
+        for table in self.tables:
+            try:
+                stats = table.reload_if_changed()
+            except Exception as e:
+                logging.error(f"Reload of {type(table).__name__} failed: {e}")
+                continue
+            if stats is not None:
+                reloaded[table] = stats
+        return reloaded
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()